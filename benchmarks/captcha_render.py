@@ -0,0 +1,74 @@
+# SCP-079-CAPTCHA - Provide challenges for newly joined members
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CAPTCHA.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compare new generators per question with the reused generators of each thread
+# Usage: python -m benchmarks.captcha_render [font_chinese] [font_english]
+
+from io import BytesIO
+from sys import argv
+from time import time
+
+from captcha.image import ImageCaptcha
+from claptcha import Claptcha
+
+from plugins.render import render_image
+
+# Fonts
+font_chinese = argv[1] if len(argv) > 1 else "/usr/share/fonts/truetype/arphic-gkai00mp/gkai00mp.ttf"
+font_english = argv[2] if len(argv) > 2 else "/usr/share/fonts/truetype/freefont/FreeMono.ttf"
+noise = 0.4
+
+# Sample questions
+questions = {
+    "captcha": (font_chinese, "一心一意"),
+    "claptcha": (font_english, "captcha")
+}
+
+
+def render_new(kind: str, text: str, font: str) -> bytes:
+    # The old way, a new generator for each question
+    if kind == "claptcha":
+        _, image = Claptcha(source=text, font=font, size=(300, 150), noise=noise).image
+    else:
+        image = ImageCaptcha(width=300, height=150, fonts=[font]).generate_image(text)
+
+    with BytesIO() as f:
+        image.save(f, format="PNG")
+        return f.getvalue()
+
+
+def rate(func, number: int) -> float:
+    start = time()
+
+    for _ in range(number):
+        func()
+
+    return number / (time() - start)
+
+
+def main():
+    number = 50
+
+    for kind, (font, text) in questions.items():
+        old = rate(lambda: render_new(kind, text, font), number)
+        new = rate(lambda: render_image(kind, text, font, noise), number)
+        print(f"{kind:>8}: new generators {old:6.1f} q/s, reused generators {new:6.1f} q/s, {new / old:4.2f}x")
+
+
+if __name__ == "__main__":
+    main()
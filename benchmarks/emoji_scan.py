@@ -0,0 +1,69 @@
+# SCP-079-CAPTCHA - Provide challenges for newly joined members
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CAPTCHA.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compare the emoji trie scanner with the substring scan it replaced
+# Usage: python -m benchmarks.emoji_scan
+
+from copy import deepcopy
+from timeit import timeit
+
+from emoji import UNICODE_EMOJI
+
+from plugins.emojis import get_emoji_trie, scan_emoji
+
+# Emoji data
+emoji_set = set(UNICODE_EMOJI.get("en", UNICODE_EMOJI))
+emoji_protect = "\U0001F642"
+emoji_trie = get_emoji_trie(emoji_set, emoji_protect)
+
+# Sample texts
+texts = {
+    "button": "\U0001F34E Apple",
+    "name": "Free \U0001F4B0\U0001F4B0 VIP \U0001F525 @channel",
+    "plain": "The quick brown fox jumps over the lazy dog " * 4,
+    "spam": "\U0001F1E8\U0001F1F3\U0001F525\U0001F44D\U0001F3FB\U0001F642 " * 20
+}
+
+
+def substring_scan(text: str) -> dict:
+    # The old way
+    emoji_dict = {}
+    emoji_set_text = {emoji for emoji in emoji_set if emoji in text and emoji not in emoji_protect}
+    emoji_old_set = deepcopy(emoji_set_text)
+
+    for emoji in emoji_old_set:
+        if any(emoji in emoji_old and emoji != emoji_old for emoji_old in emoji_old_set):
+            emoji_set_text.discard(emoji)
+
+    for emoji in emoji_set_text:
+        emoji_dict[emoji] = text.count(emoji)
+
+    return emoji_dict
+
+
+def main():
+    number = 200
+
+    for name, text in texts.items():
+        old = timeit(lambda: substring_scan(text), number=number) / number * 1e6
+        new = timeit(lambda: scan_emoji(emoji_trie, text), number=number) / number * 1e6
+        print(f"{name:>8}: substring {old:10.1f} us, trie {new:8.1f} us, {old / max(new, 1e-9):8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -26,11 +26,15 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from pyrogram import Client, idle
 
 from plugins import glovar
-from plugins.functions.etc import delay
-from plugins.functions.timers import (backup_files, interval_hour_01, interval_min_01, interval_min_10,
-                                      new_invite_link, reset_data, send_count, share_failed_users, update_admins,
-                                      update_status)
+from plugins.functions.challenge import captcha_worker, start_render
+from plugins.functions.etc import delay, delay_worker, thread
+from plugins.functions.file import save_flush
+from plugins.functions.filters import fold_regex_counts
+from plugins.functions.timers import (backup_files, deadline_worker, interval_hour_01, interval_min_01,
+                                      interval_min_10, new_invite_link, reset_data, send_count, share_failed_users,
+                                      update_admins, update_status)
 from plugins.session import renew
+from plugins.workers import stop_pools
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -38,6 +42,12 @@ logger = logging.getLogger(__name__)
 # Renew session
 renew()
 
+# Start the rendering processes
+start_render()
+
+# Start the delayed calls
+thread(delay_worker, (), pool="")
+
 # Config session
 app = Client(
     session_name="bot",
@@ -54,6 +64,14 @@ not glovar.reset_time[1] and reset_data(app)
 # Check invite link
 not glovar.invite.get("link") and new_invite_link(app, True)
 
+# Check the deadlines
+thread(deadline_worker, (app,), pool="")
+
+# Fill the captcha pool
+if glovar.captcha_pool:
+    for _ in range(max(glovar.processes, 1)):
+        thread(captcha_worker, (), pool="")
+
 # Timer
 scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
 scheduler.add_job(interval_min_01, "interval", [app], minutes=1)
@@ -72,3 +90,10 @@ idle()
 
 # Stop
 app.stop()
+
+# Save the dirty data
+fold_regex_counts()
+save_flush()
+
+# Finish the queued jobs
+stop_pools(glovar.pools)
@@ -69,6 +69,10 @@ def check_captcha(values: dict, broken: bool) -> str:
             result += f"[ERROR] [captcha] {key} - font file does not exist\n"
         elif key == "noise" and values[key] <= 0:
             result += f"[ERROR] [captcha] {key} - should be a positive float\n"
+        elif (key.startswith("pool") or key == "processes") and values[key] < 0:
+            result += f"[ERROR] [captcha] {key} - should be a non-negative integer\n"
+        elif key == "pool_low" and values[key] >= values.get("pool_high", 0) > 0:
+            result += f"[ERROR] [captcha] {key} - should be less than pool_high\n"
 
         if not broken or not result:
             continue
@@ -163,7 +167,7 @@ def check_language(values: dict, broken: bool) -> str:
             result += f"[ERROR] [language] {key} - please fill something except [DATA EXPUNGED]\n"
         elif key == "lang" and not exists(f"languages/{values[key]}.yml"):
             result += f"[ERROR] [language] {key} - language {values[key]} does not exist\n"
-        elif key == "normalize" and values[key] not in {False, True}:
+        elif key in {"cjk_only", "normalize"} and values[key] not in {False, True}:
             result += f"[ERROR] [language] {key} - please fill a valid boolean value\n"
 
         if not broken or not result:
@@ -195,7 +199,9 @@ def check_mode(values: dict, broken: bool) -> str:
     result = ""
 
     for key in values:
-        if values[key] not in {False, True}:
+        if key == "storage" and values[key] not in {"journal", "pickle", "sqlite"}:
+            result += f"[ERROR] [mode] {key} - please fill journal, pickle or sqlite\n"
+        elif key != "storage" and values[key] not in {False, True}:
             result += f"[ERROR] [mode] {key} - please fill a valid boolean value\n"
 
         if not broken or not result:
@@ -224,6 +230,22 @@ def check_time(values: dict, broken: bool) -> str:
     return result
 
 
+def check_worker(values: dict, broken: bool) -> str:
+    # Check all values in worker section
+    result = ""
+
+    for key in values:
+        if values[key] <= 0:
+            result += f"[ERROR] [worker] {key} - should be a positive integer\n"
+
+        if not broken or not result:
+            continue
+
+        raise_error(result)
+
+    return result
+
+
 def raise_error(error: str):
     error = "-" * 24 + f"\nBot refused to start because:\n" + "-" * 24 + f"\n{error}" + "-" * 24
     logger.critical("\n" + error)
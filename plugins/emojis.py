@@ -0,0 +1,91 @@
+# SCP-079-CAPTCHA - Provide challenges for newly joined members
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CAPTCHA.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from typing import Dict, Iterable
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+def get_emoji_trie(emojis: Iterable[str], protect: str = "") -> dict:
+    # Get a character trie of the emoji, the None key of a node holds the emoji that ends there
+    result = {}
+
+    try:
+        for emoji in emojis:
+            if not emoji:
+                continue
+
+            node = result
+
+            for c in emoji:
+                node = node.setdefault(c, {})
+
+            # Protected emoji are matched but not counted
+            node[None] = "" if emoji in protect else emoji
+    except Exception as e:
+        logger.warning(f"Get emoji trie error: {e}", exc_info=True)
+
+    return result
+
+
+def scan_emoji(trie: dict, text: str) -> Dict[str, int]:
+    # Count the longest non-overlapping emoji in the text, from left to right
+    result = {}
+
+    try:
+        i = 0
+        length = len(text)
+
+        while i < length:
+            node = trie.get(text[i])
+
+            if node is None:
+                i += 1
+                continue
+
+            # Walk down the trie, remember the longest match
+            emoji = None
+            end = i
+            j = i
+
+            while node is not None:
+                j += 1
+
+                if None in node:
+                    emoji = node[None]
+                    end = j
+
+                if j >= length:
+                    break
+
+                node = node.get(text[j])
+
+            if emoji is None:
+                i += 1
+                continue
+
+            if emoji:
+                result[emoji] = result.get(emoji, 0) + 1
+
+            i = end
+    except Exception as e:
+        logger.warning(f"Scan emoji error: {e}", exc_info=True)
+
+    return result
@@ -17,31 +17,33 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from concurrent.futures import ProcessPoolExecutor, wait
 from json import loads
+from multiprocessing import get_context
 from random import choice, randint, sample, shuffle
 from string import ascii_lowercase
+from time import time
 from typing import List, Optional, Union
 
-from captcha.image import ImageCaptcha
-from claptcha import Claptcha
 from pyrogram import Client
 from pyrogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message, User
 
 from .. import glovar
+from ..render import ImageBuffer, render_image, render_ping, render_warmup
+from ..status import get_wait_count, get_wait_groups, get_wait_users
+from ..workers import priority_high
 from .channel import ask_help_welcome, send_debug, share_data
 from .decorators import threaded
 from .etc import (button_data, code, get_channel_link, get_full_name, get_image_size, get_length, get_now, lang,
-                  mention_name, mention_text, random_str, t2t, thread)
-from .file import delete_file, get_new_path, save
-from .filters import (is_declared_message, is_flooded, is_limited_user, is_nm_text, is_should_ignore, is_watch_user,
-                      is_wb_text)
+                  mention_name, mention_text, random_str, t2t)
+from .file import edit_cached_photo, save, send_cached_photo
+from .filters import get_name_verdict, is_declared_message, is_flooded, is_limited_user, is_should_ignore, is_watch_user
 from .group import clear_joined_messages, delete_message, get_hint_text, get_pinned
-from .ids import init_user_id
+from .ids import add_deadline, init_user_id
 from .markup import get_inline
 from .user import (flood_user, qns_count, restrict_user, terminate_user_punish, terminate_user_succeed,
                    terminate_user_succeed_qns, terminate_user_wrong, terminate_user_wrong_qns, unrestrict_user)
-from .telegram import (delete_messages, edit_message_photo, get_chat_member, pin_chat_message,
-                       send_message, send_photo, send_report_message)
+from .telegram import delete_messages, dispatch, get_chat_member, pin_chat_message, send_message, send_report_message
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -60,11 +62,12 @@ def add_wait(client: Client, gid: int, user: User, mid: int, aid: int = 0) -> bo
         # Add the user to the wait list
         glovar.user_ids[uid]["name"] = name
         glovar.user_ids[uid]["wait"][gid] = now
+        add_deadline(uid)
         aid and glovar.user_ids[uid]["manual"].add(gid)
-        save("user_ids")
+        save("user_ids", uid)
 
         # Get group's waiting user list
-        wait_user_list = [wid for wid in glovar.user_ids if glovar.user_ids[wid]["wait"].get(gid, 0)]
+        wait_user_list = get_wait_users(gid)
 
         # Restrict the user
         restrict_user(client, gid, uid)
@@ -106,7 +109,7 @@ def add_wait(client: Client, gid: int, user: User, mid: int, aid: int = 0) -> bo
             old_id = glovar.message_ids[gid]["hint"]
             glovar.message_ids[gid]["hint"] = 0
             old_id and delete_message(client, gid, old_id)
-            old_id and save("message_ids")
+            old_id and save("message_ids", gid)
 
         # Flood situation ongoing
         elif is_flooded(gid):
@@ -198,11 +201,12 @@ def add_wait_qns(client: Client, gid: int, user: User, mid: int, aid: int = 0) -
         # Add the user to the wait list
         glovar.user_ids[uid]["name"] = name
         glovar.user_ids[uid]["wait"][gid] = now
+        add_deadline(uid)
         aid and glovar.user_ids[uid]["manual"].add(gid)
-        save("user_ids")
+        save("user_ids", uid)
 
         # Get group's waiting user list
-        wait_user_list = [wid for wid in glovar.user_ids if glovar.user_ids[wid]["wait"].get(gid, 0)]
+        wait_user_list = get_wait_users(gid)
 
         # Flood situation detected
         if len(wait_user_list) > glovar.limit_flood:
@@ -279,7 +283,7 @@ def add_failed(client: Client, gid: int, uid: int, aid: int) -> bool:
         glovar.user_ids[uid]["wait"].pop(gid, 0)
         glovar.user_ids[uid]["qns"].pop(gid, "")
         aid and glovar.user_ids[uid]["manual"].discard(gid)
-        save("user_ids")
+        save("user_ids", uid)
     except Exception as e:
         logger.warning(f"Add failed error: {e}", exc_info=True)
 
@@ -293,7 +297,7 @@ def add_flood(client: Client, gid: int, mid: int, now: int) -> bool:
     try:
         # Update flood status
         glovar.pinned_ids[gid]["last"] = now
-        save("pinned_ids")
+        save("pinned_ids", gid)
 
         # Activate flood mode
         if is_flooded(gid):
@@ -335,12 +339,10 @@ def captcha_chengyu() -> dict:
         question = choice(glovar.chinese_words["chengyu"])
         answer = question
 
-        image = ImageCaptcha(width=300, height=150, fonts=[glovar.font_chinese])
-        image_path = f"{get_new_path('.png')}"
-        image.write(question, image_path)
+        image = get_image("captcha", question, glovar.font_chinese)
 
         result = {
-            "image": image_path,
+            "image": image,
             "question": lang("question_chengyu"),
             "answer": answer,
             "limit": glovar.limit_try
@@ -370,12 +372,10 @@ def captcha_food() -> dict:
 
         shuffle(candidates)
 
-        image = ImageCaptcha(width=300, height=150, fonts=[glovar.font_chinese])
-        image_path = f"{get_new_path('.png')}"
-        image.write(question, image_path)
+        image = get_image("captcha", question, glovar.font_chinese)
 
         result = {
-            "image": image_path,
+            "image": image,
             "question": lang("question_food"),
             "answer": answer,
             "candidates": candidates,
@@ -399,12 +399,10 @@ def captcha_letter() -> dict:
 
         answer = question
 
-        image = Claptcha(source=question, font=glovar.font_english, size=(300, 150), noise=glovar.noise)
-        image_path = f"{get_new_path('.png')}"
-        image.write(image_path)
+        image = get_image("claptcha", question, glovar.font_english)
 
         result = {
-            "image": image_path,
+            "image": image,
             "question": lang("question_letter"),
             "answer": answer,
             "limit": glovar.limit_try + 1
@@ -475,12 +473,10 @@ def captcha_math_pic() -> dict:
 
         shuffle(candidates)
 
-        image = ImageCaptcha(width=300, height=150, fonts=[glovar.font_number])
-        image_path = f"{get_new_path('.png')}"
-        image.write(question, image_path)
+        image = get_image("captcha", question, glovar.font_number)
 
         result = {
-            "image": image_path,
+            "image": image,
             "question": lang("question_math_pic"),
             "answer": answer,
             "candidates": candidates,
@@ -497,24 +493,15 @@ def captcha_pic() -> dict:
     result = {}
 
     try:
-        answer = choice(list(glovar.pics))
+        candidates = sample(glovar.pic_names, 3)
+        answer = candidates[0]
         question = choice(glovar.pics[answer])
-        candidates = [answer]
-
-        for _ in range(2):
-            candidate = choice(list(glovar.pics))
-
-            while candidate in candidates:
-                candidate = choice(list(glovar.pics))
-
-            candidates.append(candidate)
-
         shuffle(candidates)
 
-        image_path = question
+        image = question
 
         result = {
-            "image": image_path,
+            "image": image,
             "question": lang("question_pic"),
             "answer": answer,
             "candidates": candidates,
@@ -538,12 +525,10 @@ def captcha_number() -> dict:
 
         answer = question
 
-        image = Claptcha(source=question, font=glovar.font_number, size=(300, 150), noise=glovar.noise)
-        image_path = f"{get_new_path('.png')}"
-        image.write(image_path)
+        image = get_image("claptcha", question, glovar.font_number)
 
         result = {
-            "image": image_path,
+            "image": image,
             "question": lang("question_number"),
             "answer": answer,
             "limit": glovar.limit_try + 1
@@ -554,6 +539,46 @@ def captcha_number() -> dict:
     return result
 
 
+def captcha_worker() -> bool:
+    # Keep the captcha pool filled
+    result = False
+
+    try:
+        while True:
+            with glovar.captcha_condition:
+                glovar.captcha_condition.wait_for(is_captcha_pool_low, 60)
+
+            fill_captcha_pool()
+    except Exception as e:
+        logger.warning(f"Captcha worker error: {e}", exc_info=True)
+
+    return result
+
+
+def fill_captcha_pool() -> bool:
+    # Refill the low captcha pools to the high watermark
+    result = False
+
+    try:
+        for question_type, pool in list(glovar.captcha_pool.items()):
+            if len(pool) > glovar.pool_low:
+                continue
+
+            while len(pool) < glovar.pool_high:
+                captcha = eval(f"captcha_{question_type}")()
+
+                if not captcha:
+                    break
+
+                pool.append(captcha)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Fill captcha pool error: {e}", exc_info=True)
+
+    return result
+
+
 def get_answers(the_list: List[str]) -> List[str]:
     # Get sorted or shuffled list
     result = the_list
@@ -609,6 +634,70 @@ def get_answer(message: Message, key: str) -> str:
     return result
 
 
+def get_captcha(question_type: str) -> dict:
+    # Get a captcha of the question type, use a pre-rendered one if possible
+    result = {}
+
+    try:
+        pool = glovar.captcha_pool.get(question_type)
+
+        if pool is not None:
+            try:
+                result = pool.popleft()
+            except IndexError:
+                result = {}
+
+            # Wake up the worker
+            if len(pool) <= glovar.pool_low:
+                with glovar.captcha_condition:
+                    glovar.captcha_condition.notify()
+
+        if result:
+            return result
+
+        # Render in the join path, track the backlog and the latency
+        with glovar.locks["render"]:
+            glovar.render_pending += 1
+
+        start = time()
+
+        try:
+            result = eval(f"captcha_{question_type}")()
+        finally:
+            with glovar.locks["render"]:
+                glovar.render_pending -= 1
+                glovar.render_latency = glovar.render_latency * 0.8 + (time() - start) * 1000 * 0.2
+    except Exception as e:
+        logger.warning(f"Get captcha error: {e}", exc_info=True)
+
+    return result
+
+
+def get_image(kind: str, text: str, font: str) -> Optional[ImageBuffer]:
+    # Render a captcha image in memory, use the rendering processes if possible
+    result = None
+
+    try:
+        data = None
+
+        if glovar.render_executor:
+            try:
+                data = glovar.render_executor.submit(render_image, kind, text, font, glovar.noise).result()
+            except Exception as e:
+                logger.warning(f"Render in process error: {e}", exc_info=True)
+
+        data, width, height = data or render_image(kind, text, font, glovar.noise)
+
+        if not data:
+            return None
+
+        result = ImageBuffer(data, width, height)
+    except Exception as e:
+        logger.warning(f"Get image error: {e}", exc_info=True)
+
+    return result
+
+
 def get_markup_ask(captcha: dict, question_type: str = "") -> Optional[InlineKeyboardMarkup]:
     # Question markup
     result = None
@@ -624,8 +713,10 @@ def get_markup_ask(captcha: dict, question_type: str = "") -> Optional[InlineKey
         candidates and markup_list.append([])
 
         # Single line mode
-        image_path = captcha.get("image")
-        width, _ = get_image_size(image_path)
+        image = captcha.get("image")
+        width = (getattr(image, "width", 0)
+                 or glovar.pic_sizes.get(image, (0,))[0]
+                 or get_image_size(image)[0])
         single = width and width < 300
         data_set = set()
 
@@ -733,6 +824,65 @@ def get_markup_hint(single: bool = False, static: bool = False,
     return result
 
 
+def get_question_tier(uid: int) -> int:
+    # Get the question tier by the load, 0 for all types, 1 for cheap types, 2 for text only
+    result = glovar.question_tier
+
+    try:
+        wait_groups = list(glovar.user_ids[uid].peek("wait"))
+        waiting = sum(get_wait_count(gid) for gid in get_wait_groups())
+        flooded = any(is_flooded(gid) for gid in wait_groups)
+
+        # The smallest captcha pool, refilled at pool_low, is a load of 1 at half of pool_low, 2 at a quarter
+        pooled = min((len(pool) for pool in list(glovar.captcha_pool.values())), default=None)
+        pool_load = 0 if pooled is None or not glovar.pool_low else glovar.pool_low / max(pooled * 2, 1)
+
+        load = (glovar.render_pending / glovar.limit_render,
+                glovar.render_latency / glovar.limit_latency,
+                waiting / glovar.limit_waiting,
+                pool_load)
+
+        # Rise at the thresholds, fall back only below half of them
+        rise = max(int(max(load) >= 1) + int(max(load) >= 2), int(flooded))
+        fall = max(int(max(load) >= 0.5) + int(max(load) >= 1), int(flooded))
+        result = max(rise, min(glovar.question_tier, fall))
+
+        if result != glovar.question_tier:
+            logger.info(f"Question tier {glovar.question_tier} -> {result}, load {load}, flooded {flooded}")
+            glovar.question_tier = result
+    except Exception as e:
+        logger.warning(f"Get question tier error: {e}", exc_info=True)
+
+    return result
+
+
+def get_question_type(uid: int) -> str:
+    # Choose a question type by the load
+    result = "math"
+
+    try:
+        if "Hans" in glovar.lang:
+            question_types = glovar.question_types["chinese"]
+        else:
+            question_types = glovar.question_types["english"]
+
+        tier = get_question_tier(uid)
+
+        # Only the types that need no rendering now
+        if tier == 1:
+            question_types = [question_type for question_type in question_types
+                              if question_type not in glovar.render_types or glovar.captcha_pool.get(question_type)]
+
+        if tier >= 2 or not question_types:
+            return "math"
+
+        result = choice(question_types)
+    except Exception as e:
+        logger.warning(f"Get question type error: {e}", exc_info=True)
+
+    return result
+
+
 def get_return_link(uid: int) -> str:
     # Get return group link
     result = ""
@@ -755,6 +905,18 @@ def get_return_link(uid: int) -> str:
     return result
 
 
+def is_captcha_pool_low() -> bool:
+    # Check if any captcha pool is low
+    result = False
+
+    try:
+        result = any(len(pool) <= glovar.pool_low for pool in list(glovar.captcha_pool.values()))
+    except Exception as e:
+        logger.warning(f"Is captcha pool low error: {e}", exc_info=True)
+
+    return result
+
+
 def question_answer(client: Client, uid: int, text: str) -> bool:
     # Answer the question
     result = False
@@ -779,7 +941,7 @@ def question_answer(client: Client, uid: int, text: str) -> bool:
             )
 
         glovar.user_ids[uid]["try"] += 1
-        save("user_ids")
+        save("user_ids", uid)
 
         if glovar.user_ids[uid]["try"] < limit:
             return question_status(client, uid, "again")
@@ -871,12 +1033,8 @@ def question_ask(client: Client, user: User, mid: int) -> bool:
         now = get_now()
 
         # Get the question data
-        if "Hans" in glovar.lang:
-            question_type = choice(glovar.question_types["chinese"])
-        else:
-            question_type = choice(glovar.question_types["english"])
-
-        captcha = eval(f"captcha_{question_type}")()
+        question_type = get_question_type(uid)
+        captcha = get_captcha(question_type)
 
         # Get limit
         limit = captcha["limit"]
@@ -894,19 +1052,18 @@ def question_ask(client: Client, user: User, mid: int) -> bool:
         markup = get_markup_ask(captcha, question_type)
 
         # Get the image
-        image_path = captcha.get("image")
+        image = captcha.get("image")
 
         # Send the question message
-        if image_path:
-            result = send_photo(
+        if image:
+            result = send_cached_photo(
                 client=client,
                 cid=glovar.captcha_group_id,
-                photo=image_path,
+                photo=image,
                 caption=text,
                 mid=mid,
                 markup=markup
             )
-            image_path.startswith("tmp/") and thread(delete_file, (image_path,))
         else:
             result = send_message(
                 client=client,
@@ -922,6 +1079,7 @@ def question_ask(client: Client, user: User, mid: int) -> bool:
             glovar.user_ids[uid]["type"] = question_type
             glovar.user_ids[uid]["mid"] = captcha_message_id
             glovar.user_ids[uid]["time"] = now
+            add_deadline(uid)
             glovar.user_ids[uid]["answer"] = captcha["answer"]
             glovar.user_ids[uid]["limit"] = limit
         else:
@@ -932,7 +1090,7 @@ def question_ask(client: Client, user: User, mid: int) -> bool:
 
             glovar.user_ids[uid]["wait"] = {}
 
-        save("user_ids")
+        save("user_ids", uid)
 
         result = True
     except Exception as e:
@@ -962,12 +1120,8 @@ def question_change(client: Client, uid: int, mid: int) -> bool:
             return False
 
         # Get the question data
-        if "Hans" in glovar.lang:
-            question_type = choice(glovar.question_types["chinese"])
-        else:
-            question_type = choice(glovar.question_types["english"])
-
-        captcha = eval(f"captcha_{question_type}")()
+        question_type = get_question_type(uid)
+        captcha = get_captcha(question_type)
 
         # Get limit
         limit = limit - tried - 1
@@ -984,18 +1138,17 @@ def question_change(client: Client, uid: int, mid: int) -> bool:
         markup = get_markup_ask(captcha)
 
         # Get the image
-        image_path = captcha.get("image", "") or "assets/none.png"
+        image = captcha.get("image") or "assets/none.png"
 
         # Edit the question message
-        result = edit_message_photo(
+        result = edit_cached_photo(
             client=client,
             cid=glovar.captcha_group_id,
             mid=mid,
-            photo=image_path,
+            photo=image,
             caption=text,
             markup=markup
         )
-        image_path.startswith("tmp/") and thread(delete_file, (image_path,))
 
         # Check if the message was edited successfully
         if not result:
@@ -1005,7 +1158,7 @@ def question_change(client: Client, uid: int, mid: int) -> bool:
         glovar.user_ids[uid]["answer"] = captcha["answer"]
         glovar.user_ids[uid]["limit"] = limit
         glovar.user_ids[uid]["try"] = 0
-        save("user_ids")
+        save("user_ids", uid)
 
         result = True
     except Exception as e:
@@ -1014,7 +1167,7 @@ def question_change(client: Client, uid: int, mid: int) -> bool:
     return result
 
 
-@threaded()
+@threaded(priority=priority_high)
 def question_status(client: Client, uid: int, the_type: str, link: str = "") -> bool:
     # Reply question status
     result = False
@@ -1126,10 +1279,10 @@ def send_hint(client: Client, the_type: str, gid: int,
             glovar.message_ids[gid]["hint"] = new_id
             old_id and delete_message(client, gid, old_id)
             old_ids = glovar.message_ids[gid]["flood"]
-            old_ids and thread(delete_messages, (client, gid, old_ids))
+            old_ids and dispatch(delete_messages, (client, gid, old_ids))
 
         # Save message ids
-        save("message_ids")
+        save("message_ids", gid)
     except Exception as e:
         logger.warning(f"Send hint error: {e}", exc_info=True)
 
@@ -1166,9 +1319,9 @@ def send_hint_qns(client: Client, the_type: str, gid: int,
 
         tag = choice(tags)
         glovar.questions[gid]["last"] = tag
-        save("questions")
+        save("questions", gid)
         glovar.user_ids[uid]["qns"][gid] = tag
-        save("user_ids")
+        save("user_ids", uid)
         question = glovar.questions[gid]["qns"][tag]["question"]
 
         text += code("-" * 24) + "\n"
@@ -1227,10 +1380,10 @@ def send_hint_qns(client: Client, the_type: str, gid: int,
             glovar.message_ids[gid]["hint"] = new_id
             old_id and delete_message(client, gid, old_id)
             old_ids = glovar.message_ids[gid]["flood"]
-            old_ids and thread(delete_messages, (client, gid, old_ids))
+            old_ids and dispatch(delete_messages, (client, gid, old_ids))
 
         # Save message ids
-        save("message_ids")
+        save("message_ids", gid)
     except Exception as e:
         logger.warning(f"Send hint qns error: {e}", exc_info=True)
 
@@ -1258,7 +1411,7 @@ def send_pin(client: Client, gid: int) -> bool:
 
         new_id = result.message_id
         old_ids = glovar.message_ids[gid]["flood"]
-        old_ids and thread(delete_messages, (client, gid, old_ids))
+        old_ids and dispatch(delete_messages, (client, gid, old_ids))
 
         if pinned_message:
             old_id = pinned_message.message_id
@@ -1273,7 +1426,7 @@ def send_pin(client: Client, gid: int) -> bool:
 
         glovar.pinned_ids[gid]["old_id"] = old_id
         glovar.pinned_ids[gid]["new_id"] = new_id
-        save("pinned_ids")
+        save("pinned_ids", gid)
 
         result = True
     except Exception as e:
@@ -1300,7 +1453,7 @@ def send_static(client: Client, gid: int, text: str, flood: bool = False, temp:
 
         if flood:
             old_ids = glovar.message_ids[gid]["flood"]
-            old_ids and thread(delete_messages, (client, gid, old_ids))
+            old_ids and dispatch(delete_messages, (client, gid, old_ids))
             glovar.message_ids[gid]["flood"].add(new_id)
         elif temp:
             old_id = glovar.message_ids[gid]["hint"]
@@ -1311,7 +1464,7 @@ def send_static(client: Client, gid: int, text: str, flood: bool = False, temp:
             old_id and delete_message(client, gid, old_id)
             glovar.message_ids[gid]["static"] = new_id
 
-        save("message_ids")
+        save("message_ids", gid)
 
         result = True
     except Exception as e:
@@ -1320,6 +1473,31 @@ def send_static(client: Client, gid: int, text: str, flood: bool = False, temp:
     return result
 
 
+def start_render() -> bool:
+    # Start the rendering processes before any other thread, preload the fonts in each of them
+    result = False
+
+    try:
+        if not glovar.processes:
+            return False
+
+        fonts = [("captcha", glovar.font_chinese), ("captcha", glovar.font_number),
+                 ("claptcha", glovar.font_english), ("claptcha", glovar.font_number)]
+        glovar.render_executor = ProcessPoolExecutor(
+            max_workers=glovar.processes,
+            mp_context=get_context("fork"),
+            initializer=render_warmup,
+            initargs=(fonts, glovar.noise)
+        )
+        wait([glovar.render_executor.submit(render_ping) for _ in range(glovar.processes)])
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Start render error: {e}", exc_info=True)
+
+    return result
+
+
 def user_captcha(client: Client, message: Optional[Message], gid: int, user: User, mid: int, now: int,
                  aid: int = 0) -> bool:
     # User CAPTCHA
@@ -1372,8 +1550,7 @@ def user_captcha(client: Client, message: Optional[Message], gid: int, user: Use
 
         # Check name
         name = get_full_name(user, True, True, True)
-        ban_name = is_nm_text(name)
-        wb_name = is_wb_text(name, False)
+        ban_name, wb_name = get_name_verdict(name, glovar.regex_generation)
 
         # Succeeded auto pass
         succeeded_time = max(user_status["succeeded"].values()) if user_status["succeeded"] else 0
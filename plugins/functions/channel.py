@@ -28,7 +28,7 @@ from .decorators import threaded
 from .etc import code, code_block, general_link, get_channel_link, get_readable_time, lang, message_link, thread
 from .file import crypt_file, data_to_file, delete_file, get_new_path, save
 from .filters import is_class_d_user
-from .telegram import get_group_info, send_document, send_message
+from .telegram import dispatch, get_group_info, send_document, send_message
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -133,7 +133,7 @@ def exchange_to_hide(client: Client) -> bool:
         text = (f"{lang('project')}{lang('colon')}{code(glovar.sender)}\n"
                 f"{lang('issue')}{lang('colon')}{code(lang('exchange_invalid'))}\n"
                 f"{lang('auto_fix')}{lang('colon')}{code(lang('protocol_1'))}\n")
-        thread(send_message, (client, glovar.critical_channel_id, text))
+        dispatch(send_message, (client, glovar.critical_channel_id, text))
 
         result = True
     except Exception as e:
@@ -197,7 +197,7 @@ def get_debug_text(client: Client, context: Union[int, Chat, List[int]]) -> str:
     return result
 
 
-@threaded()
+@threaded(pool="exchange")
 def send_debug(client: Client, gids: List[int], action: str,
                uid: int = 0, aid: int = 0,
                em: Union[int, Message] = 0, time: int = 0, duration: int = 0,
@@ -244,7 +244,7 @@ def send_debug(client: Client, gids: List[int], action: str,
 
         if file:
             result = bool(send_document(client, glovar.debug_channel_id, file, text))
-            thread(delete_file, (file,))
+            thread(delete_file, (file,), pool="disk")
         else:
             result = bool(send_message(client, glovar.debug_channel_id, text))
     except Exception as e:
@@ -253,7 +253,7 @@ def send_debug(client: Client, gids: List[int], action: str,
     return result
 
 
-@threaded()
+@threaded(pool="exchange")
 def share_data(client: Client, receivers: List[str], action: str, action_type: str,
                data: Union[bool, dict, int, str] = None, file: str = None, encrypt: bool = True) -> bool:
     # Use this function to share data in the channel
@@ -309,7 +309,7 @@ def share_data(client: Client, receivers: List[str], action: str, action_type: s
 
         # Delete the tmp file
         for f in {file, file_path}:
-            f.startswith("tmp/") and thread(delete_file, (f,))
+            f.startswith("tmp/") and thread(delete_file, (f,), pool="disk")
 
         result = bool(result)
     except Exception as e:
@@ -318,7 +318,7 @@ def share_data(client: Client, receivers: List[str], action: str, action_type: s
     return result
 
 
-@threaded()
+@threaded(pool="exchange")
 def share_data_failed(client: Client, receivers: List[str], action: str, action_type: str,
                       data: Union[bool, dict, int, str] = None, file: str = None, encrypt: bool = True) -> bool:
     # Sharing data failed, use the exchange channel instead
@@ -378,7 +378,7 @@ def update_score(client: Client, uid: int) -> bool:
                             if glovar.user_ids[uid]["failed"][gid] >= 0])
         score = pass_count * -0.2 + succeeded_count * -0.3 + failed_count * 0.6
         glovar.user_ids[uid]["score"][glovar.sender.lower()] = score
-        save("user_ids")
+        save("user_ids", uid)
         result = share_data(
             client=client,
             receivers=glovar.receivers["score"],
@@ -24,7 +24,7 @@ from pyrogram.types import Message
 from .etc import code, delay, get_text, lang, thread
 from .filters import is_class_c
 from .group import delete_message
-from .telegram import send_message, send_report_message
+from .telegram import dispatch, send_message, send_report_message
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -97,7 +97,7 @@ def command_error(client: Client, message: Message, action: str, error: str,
         if report:
             thread(send_report_message, (10, client, cid, text))
         else:
-            thread(send_message, (client, cid, text, mid))
+            dispatch(send_message, (client, cid, text, mid))
 
         result = True
     except Exception as e:
@@ -31,7 +31,7 @@ from .decorators import threaded
 from .etc import button_data, code, general_link, get_now, lang, thread
 from .file import delete_file, file_txt, save
 from .markup import get_inline
-from .telegram import get_group_info, send_document, send_message, send_report_message
+from .telegram import dispatch, get_group_info, send_document, send_message, send_report_message
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -154,7 +154,7 @@ def qns_add(client: Client, message: Message, gid: int, key: str, text: str, the
             glovar.questions[gid]["qns"][key]["wrong"] = wrong_list
 
         # Save the data
-        save("questions")
+        save("questions", gid)
 
         # Generate the text
         group_name, group_link = get_group_info(client, gid)
@@ -183,7 +183,7 @@ def qns_add(client: Client, message: Message, gid: int, key: str, text: str, the
         markup = get_inline(buttons)
 
         # Send the report message
-        thread(send_message, (client, cid, text, mid, markup))
+        dispatch(send_message, (client, cid, text, mid, markup))
 
         result = True
     except Exception as e:
@@ -204,7 +204,7 @@ def qns_remove(client: Client, message: Message, gid: int, key: str) -> bool:
 
         # Pop the data
         glovar.questions[gid]["qns"].pop(key, {})
-        save("questions")
+        save("questions", gid)
 
         # Generate the text
         group_name, group_link = get_group_info(client, gid)
@@ -216,7 +216,7 @@ def qns_remove(client: Client, message: Message, gid: int, key: str) -> bool:
                 f"{lang('question')}{lang('colon')}{code(question)}\n")
 
         # Send the report message
-        thread(send_message, (client, cid, text, mid))
+        dispatch(send_message, (client, cid, text, mid))
 
         result = True
     except Exception as e:
@@ -225,7 +225,7 @@ def qns_remove(client: Client, message: Message, gid: int, key: str) -> bool:
     return result
 
 
-@threaded()
+@threaded(pool="read")
 def qns_show(client: Client, message: Message, gid: int, file: bool = False) -> bool:
     # Show all custom questions
     result = False
@@ -345,7 +345,7 @@ def qns_show_file(client: Client, message: Message, gid: int,
         send_document(client, cid, file, caption, mid)
 
         # Delete the file
-        thread(delete_file, (file,))
+        thread(delete_file, (file,), pool="disk")
 
         result = True
     except Exception as e:
@@ -376,7 +376,7 @@ def start_qns(client: Client, message: Message, key: str) -> bool:
                 f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('action_qns'))}\n"
                 f"{lang('description')}{lang('colon')}{code(lang('description_qns'))}\n")
-        thread(send_message, (client, cid, text, mid))
+        dispatch(send_message, (client, cid, text, mid))
 
         result = True
     except Exception as e:
@@ -396,7 +396,7 @@ def update_config(client: Client, message: Message, config: dict, more: str = ""
 
         # Update the config
         glovar.configs[gid] = deepcopy(config)
-        save("configs")
+        save("configs", gid)
 
         # Send the report message
         text = (f"{lang('admin_group')}{lang('colon')}{code(aid)}\n"
@@ -21,6 +21,7 @@ from functools import wraps
 
 from pyrogram.errors import FloodWait
 
+from ..workers import priority_normal
 from .etc import thread, wait_flood
 
 # Enable logging
@@ -46,11 +47,11 @@ def retry(func):
     return wrapper
 
 
-def threaded(daemon: bool = True):
+def threaded(daemon: bool = True, pool: str = "write", priority: int = priority_normal):
     # Run with thread
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            return thread(func, args, kwargs, daemon)
+            return thread(func, args, kwargs, daemon, pool, priority)
         return wrapper
     return decorator
@@ -17,16 +17,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from copy import deepcopy
+import re
 from datetime import datetime
+from functools import lru_cache
+from heapq import heappop, heappush
 from html import escape
 from json import dumps
 from random import choice, uniform
-from re import sub
 from string import ascii_letters, digits
-from threading import Thread, Timer
-from time import localtime, sleep, strftime, time
-from typing import Any, Callable, Optional, Union
+from threading import Thread
+from time import localtime, monotonic, sleep, strftime, time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
 from unicodedata import normalize
 
 from cryptography.fernet import Fernet
@@ -36,6 +37,8 @@ from pyrogram.types import Message, User
 from pyrogram.errors import FloodWait
 
 from .. import glovar
+from ..emojis import scan_emoji
+from ..workers import priority_normal
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -43,6 +46,13 @@ logger = logging.getLogger(__name__)
 # Init Opencc
 converter = OpenCC(config="t2s.json")
 
+# CJK code points, including radicals, kana, symbols and the extension planes
+cjk_pattern = re.compile("[\u2e80-\u9fff\ua960-\ua97f\uac00-\ud7ff\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef"
+                         "\U00020000-\U0003134f]")
+
+# Characters kept in the pure mode
+pure_pattern = re.compile(r"""[^\da-zA-Z一-龥.,:'"?!~;()。，？！～@“”]""")
+
 
 def bold(text: Any) -> str:
     # Get a bold text
@@ -132,20 +142,59 @@ def crypt_str(operation: str, text: str, key: bytes) -> str:
     return result
 
 
-def delay(secs: int, target: Callable, args: list = None) -> bool:
-    # Call a function with delay
+def cancel_delay(key: Hashable) -> bool:
+    # Cancel a delayed call by its key
     result = False
 
     try:
-        t = Timer(secs, target, args)
-        t.daemon = True
-        result = t.start() or True
+        with glovar.delay_condition:
+            result = glovar.delay_tasks.pop(key, None) is not None
+    except Exception as e:
+        logger.warning(f"Cancel delay error: {e}", exc_info=True)
+
+    return result
+
+
+def delay(secs: float, target: Callable, args: list = None, key: Hashable = None, keep: bool = False,
+          pool: str = "write") -> bool:
+    # Call a function with delay in a worker pool, a call with the same key replaces the pending one,
+    # or is dropped if keep is True
+    result = False
+
+    try:
+        with glovar.delay_condition:
+            if keep and key in glovar.delay_tasks:
+                return True
+
+            glovar.delay_count += 1
+            seq = glovar.delay_count
+            key = ("delay", seq) if key is None else key
+            due = monotonic() + secs
+            glovar.delay_tasks[key] = (seq, target, args or [], pool)
+            heappush(glovar.delays, (due, seq, key))
+            glovar.delays[0][1] == seq and glovar.delay_condition.notify()
+
+        result = True
     except Exception as e:
         logger.warning(f"Delay error: {e}", exc_info=True)
 
     return result
 
 
+def delay_worker() -> bool:
+    # Run the due delayed calls
+    result = False
+
+    try:
+        while True:
+            for target, args, pool in get_due_delays():
+                thread(target, tuple(args), pool=pool)
+    except Exception as e:
+        logger.warning(f"Delay worker error: {e}", exc_info=True)
+
+    return result
+
+
 def general_link(text: Union[int, str], link: str) -> str:
     # Get a general link
     result = ""
@@ -189,6 +238,61 @@ def get_channel_link(message: Union[int, Message]) -> str:
     return result
 
 
+def get_delay_count() -> int:
+    # Get the count of pending delayed calls
+    result = 0
+
+    try:
+        result = len(glovar.delay_tasks)
+    except Exception as e:
+        logger.warning(f"Get delay count error: {e}", exc_info=True)
+
+    return result
+
+
+def get_due_delays() -> List[Tuple[Callable, list, str]]:
+    # Wait for the next delayed call, get the due calls
+    result = []
+
+    try:
+        with glovar.delay_condition:
+            now = monotonic()
+
+            while not glovar.delays or glovar.delays[0][0] > now:
+                timeout = glovar.delays and glovar.delays[0][0] - now or None
+                glovar.delay_condition.wait(timeout)
+                now = monotonic()
+
+            while glovar.delays and glovar.delays[0][0] <= now:
+                _, seq, key = heappop(glovar.delays)
+                task = glovar.delay_tasks.get(key)
+
+                if not task or task[0] != seq:
+                    continue
+
+                glovar.delay_tasks.pop(key, None)
+                result.append(task[1:])
+    except Exception as e:
+        logger.warning(f"Get due delays error: {e}", exc_info=True)
+
+    return result
+
+
+def get_emoji_counts(text: str) -> Dict[str, int]:
+    # Get the emoji in the text and their counts, protected emoji are not counted
+    result = {}
+
+    try:
+        if not text:
+            return {}
+
+        result = scan_emoji(glovar.emoji_trie, text)
+    except Exception as e:
+        logger.warning(f"Get emoji counts error: {e}", exc_info=True)
+
+    return result
+
+
 def get_full_name(user: User, normal: bool = False, printable: bool = False, pure: bool = False) -> str:
     # Get user's full name
     result = ""
@@ -247,16 +351,7 @@ def get_length(text: str) -> int:
         if not text:
             return 0
 
-        emoji_dict = {}
-        emoji_set = {emoji for emoji in glovar.emoji_set if emoji in text and emoji not in glovar.emoji_protect}
-        emoji_old_set = deepcopy(emoji_set)
-
-        for emoji in emoji_old_set:
-            if any(emoji in emoji_old and emoji != emoji_old for emoji_old in emoji_old_set):
-                emoji_set.discard(emoji)
-
-        for emoji in emoji_set:
-            emoji_dict[emoji] = text.count(emoji)
+        emoji_dict = get_emoji_counts(text)
 
         length_add = 0
 
@@ -429,6 +524,19 @@ def random_str(i: int) -> str:
     return result
 
 
+@lru_cache(maxsize=glovar.limit_convert)
+def t2s(text: str) -> str:
+    # Convert traditional Chinese to simplified Chinese, cached by the input
+    result = text
+
+    try:
+        result = converter.convert(text)
+    except Exception as e:
+        logger.warning(f"T2S error: {e}", exc_info=True)
+
+    return result
+
+
 def t2t(text: str, normal: bool, printable: bool, pure: bool = False) -> str:
     # Convert the string, text to text
     result = text
@@ -438,30 +546,37 @@ def t2t(text: str, normal: bool, printable: bool, pure: bool = False) -> str:
             return ""
 
         if glovar.normalize and normal:
-            for special in ["spc", "spe"]:
-                result = "".join(eval(f"glovar.{special}_dict").get(t, t) for t in result)
+            result = result.translate(glovar.special_table)
 
+        # NFKC and OpenCC do not change ASCII text
+        if glovar.normalize and normal and not result.isascii():
             result = normalize("NFKC", result)
 
-        if glovar.normalize and normal and "Hans" in glovar.lang:
-            result = converter.convert(result)
+            if "Hans" in glovar.lang and (not glovar.cjk_only or cjk_pattern.search(result)):
+                result = t2s(result)
 
-        if printable:
+        if printable and not result.isprintable():
             result = "".join(t for t in result if t.isprintable() or t in {"\n", "\r", "\t"})
 
         if pure:
-            result = sub(r"""[^\da-zA-Z一-龥.,:'"?!~;()。，？！～@“”]""", "", result)
+            result = pure_pattern.sub("", result)
     except Exception as e:
         logger.warning(f"T2T error: {e}", exc_info=True)
 
     return result
 
 
-def thread(target: Callable, args: tuple, kwargs: dict = None, daemon: bool = True) -> bool:
-    # Call a function using thread
+def thread(target: Callable, args: tuple, kwargs: dict = None, daemon: bool = True, pool: str = "write",
+           priority: int = priority_normal) -> bool:
+    # Call a function in a worker pool, the non-daemon jobs go to the disk pool, no pool means a new thread
     result = False
 
     try:
+        pool = pool if daemon else "disk"
+
+        if pool and glovar.pools.get(pool):
+            return glovar.pools[pool].submit(target, args, kwargs, priority)
+
         t = Thread(target=target, args=args, kwargs=kwargs, daemon=daemon)
         t.daemon = daemon
         result = t.start() or True
@@ -472,10 +587,13 @@ def thread(target: Callable, args: tuple, kwargs: dict = None, daemon: bool = Tr
 
 
 def wait_flood(e: FloodWait) -> bool:
-    # Wait flood secs
+    # Wait flood secs, unless the rate limiter already holds the calls
     result = False
 
     try:
+        if getattr(e, "limited", False):
+            return True
+
         result = sleep(e.x + uniform(0.5, 1.0)) or True
     except Exception as e:
         logger.warning(f"Wait flood error: {e}", exc_info=True)
@@ -18,20 +18,22 @@
 
 import logging
 from csv import writer
-from os import remove
+from hashlib import sha256
+from os import fsync, remove, replace, stat
 from os.path import exists
-from pickle import dump
+from pickle import dump, dumps
 from shutil import copyfile
-from time import sleep
-from typing import Any, List
+from time import sleep, time
+from typing import Any, BinaryIO, List, Optional, Set, Union
 
 from pyAesCrypt import decryptFile, encryptFile
 from pyrogram import Client
+from pyrogram.types import InlineKeyboardMarkup, Message
 
 from .. import glovar
-from .decorators import threaded
-from .etc import random_str
-from .telegram import download_media
+from ..status import UserTable
+from .etc import random_str, thread
+from .telegram import download_media, edit_message_photo, file_invalid, send_photo
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -91,6 +93,36 @@ def delete_file(path: str) -> bool:
     return result
 
 
+def edit_cached_photo(client: Client, cid: int, mid: int, photo: Union[str, BinaryIO], caption: str = "",
+                      markup: InlineKeyboardMarkup = None) -> Union[bool, Message, None]:
+    # Edit the message's photo, reuse the uploaded file with the same content
+    result = None
+
+    try:
+        file_id = get_file_id(photo)
+
+        if file_id:
+            result = edit_message_photo(client, cid, mid, file_id, caption, markup)
+
+        # Only upload the file again if the file id can not be used anymore, keep other failures
+        if file_id and result != file_invalid:
+            return result
+
+        if file_id:
+            set_file_id(photo, "")
+
+        result = edit_message_photo(client, cid, mid, photo, caption, markup)
+
+        if result == file_invalid:
+            return None
+
+        result and set_file_id(photo, result)
+    except Exception as e:
+        logger.warning(f"Edit cached photo error: {e}", exc_info=True)
+
+    return result
+
+
 def file_tsv(first_line: list, lines: List[list], prefix: str = "") -> str:
     # Generate a TSV file
     result = ""
@@ -143,6 +175,59 @@ def get_downloaded_path(client: Client, file_id: str) -> str:
     return result
 
 
+def get_due_ids(file: str, column: str, until: int) -> Set[int]:
+    # Get the ids whose indexed column is due
+    result = set()
+
+    try:
+        with glovar.locks["flush"]:
+            rows = glovar.sqlite_connection.execute(f"SELECT id FROM {file} WHERE {column} > 0 AND {column} <= ?",
+                                                    (until,)).fetchall()
+
+        result = {row[0] for row in rows}
+    except Exception as e:
+        logger.warning(f"Get due ids error: {e}", exc_info=True)
+
+    return result
+
+
+def get_file_hash(path: str) -> str:
+    # Get the content hash of a file, only read the file again when it changes
+    result = ""
+
+    try:
+        status = stat(path)
+        size, mtime = status.st_size, status.st_mtime_ns
+        cached = glovar.file_hashes.get(path)
+
+        if cached and cached[:2] == (size, mtime):
+            return cached[2]
+
+        with open(path, "rb") as f:
+            result = sha256(f.read()).hexdigest()
+
+        glovar.file_hashes[path] = (size, mtime, result)
+    except Exception as e:
+        logger.warning(f"Get file hash error: {e}", exc_info=True)
+
+    return result
+
+
+def get_file_id(photo: Union[str, BinaryIO]) -> str:
+    # Get the cached file id of a local file
+    result = ""
+
+    try:
+        if not isinstance(photo, str) or not exists(photo):
+            return ""
+
+        result = glovar.file_ids.get(get_file_hash(photo), "")
+    except Exception as e:
+        logger.warning(f"Get file id error: {e}", exc_info=True)
+
+    return result
+
+
 def get_new_path(extension: str = "", prefix: str = "") -> str:
     # Get a new path in tmp directory
     result = ""
@@ -160,23 +245,307 @@ def get_new_path(extension: str = "", prefix: str = "") -> str:
     return result
 
 
-@threaded(daemon=False)
-def save(file: str) -> bool:
-    # Save a global variable to a file
+def get_table_row(columns: List[str], key: int, value: Any) -> tuple:
+    # Get the row of a record, a RuntimeError of a record changed during pickling is left to the caller
+    row = [key]
+
+    for column in columns:
+        if column == "wait":
+            row.append(min((t for t in value["wait"].values() if t), default=0))
+        elif column == "failed":
+            row.append(min((t for t in value["failed"].values() if t > 0), default=0))
+        else:
+            row.append(value[column])
+
+    row.append(dumps(value))
+
+    return tuple(row)
+
+
+def replace_table(file: str, data: dict) -> bool:
+    # Replace all rows of a table in one transaction, the caller should hold the flush lock
+    result = False
+
+    try:
+        columns = glovar.sqlite_columns[file]
+        rows = [get_table_row(columns, key, value) for key, value in data.items()]
+        names = "".join(f"{column}, " for column in columns)
+        marks = "?, " * len(columns)
+
+        with glovar.sqlite_connection:
+            glovar.sqlite_connection.execute(f"DELETE FROM {file}")
+            glovar.sqlite_connection.executemany(f"INSERT INTO {file} (id, {names}data) VALUES (?, {marks}?)", rows)
+
+        glovar.save_counts["record"] += len(rows)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Replace table error: {e}", exc_info=True)
+
+    return result
+
+
+def save(file: str, key: int = None) -> bool:
+    # Mark a global variable as dirty, the writer will save it later
     result = False
 
     try:
         if not glovar:
             return False
 
+        with glovar.locks["save"]:
+            glovar.save_counts["request"] += 1
+
+            if file in glovar.save_dirty:
+                glovar.save_counts["merge"] += 1
+            elif key is None or file not in glovar.keyed_files:
+                glovar.save_dirty.add(file)
+                glovar.save_keys.pop(file, set())
+            elif key in glovar.save_keys.get(file, set()):
+                glovar.save_counts["merge"] += 1
+            else:
+                glovar.save_keys.setdefault(file, set()).add(key)
+
+            if not glovar.save_started:
+                glovar.save_started = True
+                thread(save_writer, (), pool="")
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Save error: {e}", exc_info=True)
+
+    return result
+
+
+def save_file(file: str) -> bool:
+    # Save a global variable to a file
+    result = False
+
+    try:
         with open(f"data/.{file}", "wb") as f:
             dump(eval(f"glovar.{file}"), f)
 
-        result = copyfile(f"data/.{file}", f"data/{file}") or True
+        copyfile(f"data/.{file}", f"data/{file}")
+
+        # Start a new journal after the snapshot
+        if glovar.storage == "journal" and file in glovar.journal_files:
+            snapshot = stat(f"data/{file}")
+
+            with open(f"data/.{file}.journal", "wb") as f:
+                dump(("snapshot", snapshot.st_size, snapshot.st_mtime_ns), f)
+
+            replace(f"data/.{file}.journal", f"data/{file}.journal")
+            glovar.journal_counts[file] = 0
+
+        result = True
     except RuntimeError:
-        sleep(1)
-        return save(file)
+        # The data changed during pickling, save it in the next flush
+        with glovar.locks["save"]:
+            glovar.save_dirty.add(file)
     except Exception as e:
-        logger.warning(f"Save error: {e}", exc_info=True)
+        logger.warning(f"Save file error: {e}", exc_info=True)
+
+    return result
+
+
+def save_flush() -> bool:
+    # Save all dirty global variables
+    result = False
+
+    try:
+        with glovar.locks["flush"]:
+            with glovar.locks["save"]:
+                files = glovar.save_dirty
+                glovar.save_dirty = set()
+                keys = glovar.save_keys
+                glovar.save_keys = {}
+
+            if not files and not keys:
+                return True
+
+            start = time()
+
+            for file in sorted(files):
+                if glovar.storage == "sqlite" and file in glovar.keyed_files:
+                    save_table(file)
+                else:
+                    save_file(file)
+
+            for file in sorted(keys):
+                if file in files:
+                    continue
+
+                if glovar.storage == "sqlite":
+                    save_table(file, keys[file])
+                else:
+                    save_journal(file, keys[file])
+
+            cost = time() - start
+            glovar.save_counts["flush"] += 1
+            glovar.save_counts["file"] += len(files)
+            glovar.save_counts["time"] += cost
+            glovar.save_counts["max"] = max(glovar.save_counts["max"], cost)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Save flush error: {e}", exc_info=True)
+
+    return result
+
+
+def save_journal(file: str, keys: Set[int]) -> bool:
+    # Append the changed records of a global variable to its journal
+    result = False
+
+    try:
+        # A journal always starts with a snapshot
+        if not exists(f"data/{file}.journal"):
+            return save_file(file)
+
+        data = eval(f"glovar.{file}")
+        records = []
+
+        for key in keys:
+            try:
+                records.append(dumps((key, data.get(key))))
+            except RuntimeError:
+                with glovar.locks["save"]:
+                    glovar.save_keys.setdefault(file, set()).add(key)
+
+        with open(f"data/{file}.journal", "ab") as f:
+            f.write(b"".join(records))
+            f.flush()
+            fsync(f.fileno())
+
+        glovar.save_counts["record"] += len(records)
+        glovar.journal_counts[file] = glovar.journal_counts.get(file, 0) + len(records)
+
+        # Compact the journal into a new snapshot
+        if glovar.journal_counts[file] >= glovar.limit_journal:
+            save(file)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Save journal error: {e}", exc_info=True)
+
+    return result
+
+
+def save_table(file: str, keys: Set[int] = None) -> bool:
+    # Save the changed records of a global variable to the database
+    result = False
+
+    try:
+        data = eval(f"glovar.{file}")
+        columns = glovar.sqlite_columns[file]
+        full = keys is None
+
+        if full:
+            keys = list(data)
+
+        rows = []
+        deletes = []
+
+        with glovar.locks["flush"]:
+            for key in keys:
+                value = data.get(key)
+
+                if value is None:
+                    deletes.append((key,))
+                    continue
+
+                try:
+                    rows.append(get_table_row(columns, key, value))
+                except RuntimeError:
+                    with glovar.locks["save"]:
+                        glovar.save_keys.setdefault(file, set()).add(key)
+
+            names = "".join(f"{column}, " for column in columns)
+            marks = "?, " * len(columns)
+
+            with glovar.sqlite_connection:
+                # The records that are not in memory are kept
+                full and not isinstance(data, UserTable) and glovar.sqlite_connection.execute(f"DELETE FROM {file}")
+                glovar.sqlite_connection.executemany(f"DELETE FROM {file} WHERE id = ?", deletes)
+                glovar.sqlite_connection.executemany(f"INSERT OR REPLACE INTO {file} (id, {names}data) "
+                                                     f"VALUES (?, {marks}?)", rows)
+
+        glovar.save_counts["record"] += len(rows) + len(deletes)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Save table error: {e}", exc_info=True)
+
+    return result
+
+
+def save_writer() -> bool:
+    # Flush the dirty global variables periodically
+    result = False
+
+    try:
+        while True:
+            sleep(glovar.time_save)
+            save_flush()
+    except Exception as e:
+        logger.warning(f"Save writer error: {e}", exc_info=True)
+        glovar.save_started = False
+
+    return result
+
+
+def send_cached_photo(client: Client, cid: int, photo: Union[str, BinaryIO], caption: str = "", mid: int = None,
+                      markup: InlineKeyboardMarkup = None) -> Union[bool, Message, None]:
+    # Send a photo to a chat, reuse the uploaded file with the same content
+    result = None
+
+    try:
+        file_id = get_file_id(photo)
+
+        if file_id:
+            result = send_photo(client, cid, file_id, caption, mid, markup)
+
+        # Only upload the file again if the file id can not be used anymore, keep other failures
+        if file_id and result != file_invalid:
+            return result
+
+        if file_id:
+            set_file_id(photo, "")
+
+        result = send_photo(client, cid, photo, caption, mid, markup)
+
+        if result == file_invalid:
+            return None
+
+        result and set_file_id(photo, result)
+    except Exception as e:
+        logger.warning(f"Send cached photo error: {e}", exc_info=True)
+
+    return result
+
+
+def set_file_id(photo: Union[str, BinaryIO], message: Optional[Message]) -> bool:
+    # Cache the file id of a local file from the sent message, or drop it
+    result = False
+
+    try:
+        if not isinstance(photo, str) or not exists(photo):
+            return False
+
+        file_hash = get_file_hash(photo)
+
+        if not file_hash:
+            return False
+
+        if message and message.photo:
+            glovar.file_ids[file_hash] = message.photo.file_id
+        elif not glovar.file_ids.pop(file_hash, ""):
+            return False
+
+        save("file_ids")
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Set file id error: {e}", exc_info=True)
 
     return result
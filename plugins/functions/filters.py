@@ -18,21 +18,25 @@
 
 import logging
 import re
-from copy import deepcopy
+from functools import lru_cache
 from string import ascii_lowercase
-from typing import Match, Optional, Union
+from typing import Dict, List, Match, Optional, Pattern, Set, Tuple, Union
 
 from pyrogram import filters
 from pyrogram.types import ChatMemberUpdated, Message, User, CallbackQuery
 
 from .. import glovar
-from .etc import get_full_name, get_now, get_text
+from .etc import get_emoji_counts, get_full_name, get_now, get_text
 from .file import save
 from .ids import init_group_id
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
+# Whitespace patterns used before matching the regex rules
+spaces_pattern = re.compile(r"\s{2,}")
+space_pattern = re.compile(r"\s")
+
 
 def is_aio(_, __, ___) -> bool:
     # Check if the program is under all-in-one mode
@@ -382,15 +386,7 @@ def is_ad_text(text: str, ocr: bool, matched: str = "") -> str:
         if not text:
             return ""
 
-        for c in ascii_lowercase:
-            if c == matched:
-                continue
-
-            if not is_regex_text(f"ad{c}", text, ocr):
-                continue
-
-            result = c
-            break
+        result = min(get_ad_types(text, ocr, 1, {matched}), default="")
     except Exception as e:
         logger.warning(f"Is ad text error: {e}", exc_info=True)
 
@@ -419,21 +415,17 @@ def is_ban_text(text: str, ocr: bool, message: Message = None) -> bool:
             return True
 
         # ad_ + con
-        ad = is_ad_text(text, ocr)
+        ad_types = get_ad_types(text, ocr, 2)
 
-        if ad and con:
+        if ad_types and con:
             return True
 
         # ad_ + emoji
-        if ad and emoji:
+        if ad_types and emoji:
             return True
 
         # ad_ + ad_
-        if not ad:
-            return False
-
-        ad = is_ad_text(text, ocr, ad)
-        result = bool(ad)
+        result = len(ad_types) >= 2
     except Exception as e:
         logger.warning(f"Is ban text error: {e}", exc_info=True)
 
@@ -534,16 +526,7 @@ def is_emoji(the_type: str, text: str, message: Message = None) -> bool:
         if message:
             text = get_text(message)
 
-        emoji_dict = {}
-        emoji_set = {emoji for emoji in glovar.emoji_set if emoji in text and emoji not in glovar.emoji_protect}
-        emoji_old_set = deepcopy(emoji_set)
-
-        for emoji in emoji_old_set:
-            if any(emoji in emoji_old and emoji != emoji_old for emoji_old in emoji_old_set):
-                emoji_set.discard(emoji)
-
-        for emoji in emoji_set:
-            emoji_dict[emoji] = text.count(emoji)
+        emoji_dict = get_emoji_counts(text)
 
         # Check ad
         if the_type == "ad":
@@ -704,31 +687,25 @@ def is_regex_text(word_type: str, text: str, ocr: bool = False, again: bool = Fa
     try:
         if text:
             if not again:
-                text = re.sub(r"\s{2,}", " ", text)
+                text = spaces_pattern.sub(" ", text)
             elif " " in text:
-                text = re.sub(r"\s", "", text)
+                text = space_pattern.sub("", text)
             else:
                 return None
         else:
             return None
 
-        with glovar.locks["regex"]:
-            words = list(eval(f"glovar.{word_type}_words"))
-
-        for word in words:
-            if ocr and "(?# nocr)" in word:
+        for word, pattern, nocr in get_regex_patterns(word_type):
+            if ocr and nocr:
                 continue
 
-            result = re.search(word, text, re.I | re.S | re.M)
+            result = pattern.search(text)
 
             # Count and return
             if not result:
                 continue
 
-            count = eval(f"glovar.{word_type}_words").get(word, 0)
-            count += 1
-            eval(f"glovar.{word_type}_words")[word] = count
-            save(f"{word_type}_words")
+            count_regex_word(word_type, word)
 
             return result
 
@@ -763,7 +740,7 @@ def is_should_ignore(gid: int, user: Union[int, User], aid: int = 0) -> bool:
 
         name = get_full_name(user, True, True, True)
 
-        if not name or not is_nm_text(name):
+        if not name or not get_name_verdict(name, glovar.regex_generation)[0]:
             return False
 
         result = True
@@ -829,9 +806,183 @@ def is_wb_text(text: str, ocr: bool) -> bool:
                 or is_regex_text("spc", text, ocr)):
             return True
 
-        result = any(c not in {"i"} and is_regex_text(f"ad{c}", text, ocr)
-                     for c in ascii_lowercase)
+        result = bool(get_ad_types(text, ocr, 1, {"i"}))
     except Exception as e:
         logger.warning(f"Is wb text error: {e}", exc_info=True)
 
     return result
+
+
+def count_regex_word(word_type: str, word: str) -> bool:
+    # Count a hit of the regex rule in memory
+    result = False
+
+    try:
+        with glovar.locks["count"]:
+            counts = glovar.regex_counts.setdefault(word_type, {})
+            counts[word] = counts.get(word, 0) + 1
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Count regex word error: {e}", exc_info=True)
+
+    return result
+
+
+def fold_regex_counts() -> bool:
+    # Fold the counted hits into the regex rules, save the changed files
+    result = False
+
+    glovar.locks["regex"].acquire()
+
+    try:
+        with glovar.locks["count"]:
+            regex_counts, glovar.regex_counts = glovar.regex_counts, {}
+
+        for word_type, counts in regex_counts.items():
+            words = eval(f"glovar.{word_type}_words")
+
+            for word, count in counts.items():
+                # The rule may be removed by REGEX
+                if word not in words:
+                    continue
+
+                words[word] = words[word] + count
+
+            save(f"{word_type}_words")
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Fold regex counts error: {e}", exc_info=True)
+    finally:
+        glovar.locks["regex"].release()
+
+    return result
+
+
+def get_ad_types(text: str, ocr: bool, limit: int = 0, skip: Set[str] = None) -> Dict[str, str]:
+    # Get the ad families that the text hit, with the rule that hit in each family,
+    # stop after the limit of families is reached, 0 means all families
+    result = {}
+
+    try:
+        if not text:
+            return {}
+
+        # Try the text with collapsed spaces first, then the text without spaces
+        text = spaces_pattern.sub(" ", text)
+        texts = [text]
+        " " in text and texts.append(space_pattern.sub("", text))
+
+        for c in ascii_lowercase:
+            if limit and len(result) >= limit:
+                break
+
+            if skip and c in skip:
+                continue
+
+            word = get_ad_word(f"ad{c}", texts, ocr)
+
+            if not word:
+                continue
+
+            result[c] = word
+
+        for c, word in result.items():
+            count_regex_word(f"ad{c}", word)
+    except Exception as e:
+        logger.warning(f"Get ad types error: {e}", exc_info=True)
+
+    return result
+
+
+def get_ad_word(word_type: str, texts: List[str], ocr: bool) -> str:
+    # Get the first rule of the ad family that hit one of the texts
+    result = ""
+
+    try:
+        for text in texts:
+            for word, pattern, nocr in get_regex_patterns(word_type):
+                if ocr and nocr:
+                    continue
+
+                if not pattern.search(text):
+                    continue
+
+                return word
+    except Exception as e:
+        logger.warning(f"Get ad word error: {e}", exc_info=True)
+
+    return result
+
+
+@lru_cache(maxsize=glovar.limit_name)
+def get_name_verdict(name: str, generation: int) -> Tuple[bool, bool]:
+    # Get the nm and wb verdict of a normalized name, cached with the regex generation of the rules
+    result = (False, False)
+
+    try:
+        result = (is_nm_text(name), is_wb_text(name, False))
+    except Exception as e:
+        logger.warning(f"Get name verdict error: {e}", exc_info=True)
+
+    return result
+
+
+def get_regex_patterns(word_type: str) -> List[Tuple[str, Pattern, bool]]:
+    # Get the compiled regex rules of the word type
+    result = []
+
+    try:
+        result = glovar.regex_patterns.get(word_type)
+
+        if result is not None:
+            return result
+
+        with glovar.locks["regex"]:
+            result = glovar.regex_patterns.get(word_type)
+
+            if result is None:
+                result = update_regex_patterns(word_type)
+    except Exception as e:
+        logger.warning(f"Get regex patterns error: {e}", exc_info=True)
+
+    return result or []
+
+
+def update_regex_patterns(word_type: str) -> List[Tuple[str, Pattern, bool]]:
+    # Compile the regex rules of the word type, the caller should hold the regex lock
+    result = []
+
+    try:
+        for word in list(eval(f"glovar.{word_type}_words")):
+            try:
+                pattern = re.compile(word, re.I | re.S | re.M)
+            except re.error as e:
+                logger.warning(f"Compile regex {word!r} of {word_type} error: {e}")
+                continue
+
+            result.append((word, pattern, "(?# nocr)" in word))
+
+        glovar.regex_patterns[word_type] = result
+        update_regex_generation()
+    except Exception as e:
+        logger.warning(f"Update regex patterns error: {e}", exc_info=True)
+
+    return result
+
+
+def update_regex_generation() -> bool:
+    # Start a new regex generation, the name verdicts of the old rules are dropped,
+    # the caller should hold the regex lock
+    result = False
+
+    try:
+        glovar.regex_generation += 1
+        get_name_verdict.cache_clear()
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Update regex generation error: {e}", exc_info=True)
+
+    return result
@@ -23,16 +23,18 @@ from pyrogram import Client
 from pyrogram.types import Chat, ChatMember, InlineKeyboardButton, InlineKeyboardMarkup, Message, User
 
 from .. import glovar
+from ..status import get_wait_groups
 from .decorators import threaded
-from .etc import code, get_now, get_text_user, lang, mention_id, mention_name, mention_text, thread
+from .etc import (cancel_delay, code, delay, get_now, get_text_user, lang, mention_id, mention_name, mention_text,
+                  thread)
 from .file import save
-from .telegram import delete_messages, get_chat, get_messages, leave_chat, send_message
+from .telegram import delete_messages, dispatch, get_chat, get_messages, leave_chat, send_message
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
-@threaded()
+@threaded(pool="read")
 def clear_joined_messages(client: Client, gid: int, mid: int) -> bool:
     # Clear joined messages
     result = False
@@ -70,7 +72,7 @@ def delete_hint(client: Client) -> bool:
         now = get_now()
 
         # Get the wait group list
-        wait_group_list = {gid for uid in list(glovar.user_ids) for gid in list(glovar.user_ids[uid]["wait"])}
+        wait_group_list = get_wait_groups()
 
         # Proceed
         for gid in list(glovar.message_ids):
@@ -86,7 +88,7 @@ def delete_hint(client: Client) -> bool:
 
             if mids and gid not in wait_group_list:
                 glovar.message_ids[gid]["flood"] = set()
-                thread(delete_messages, (client, gid, mids))
+                dispatch(delete_messages, (client, gid, mids))
 
             # Manual hint
             if not glovar.message_ids[gid].get("manual", {}):
@@ -124,23 +126,52 @@ def delete_hint(client: Client) -> bool:
     return result
 
 
-@threaded()
 def delete_message(client: Client, gid: int, mid: int) -> bool:
-    # Delete a single message
+    # Delete a single message, the messages of a group are deleted together in a short while
     result = False
 
     try:
         if not gid or not mid:
             return True
 
-        mids = [mid]
-        result = delete_messages(client, gid, mids)
+        with glovar.locks["delete"]:
+            mids = glovar.delete_ids.setdefault(gid, [])
+            mids.append(mid)
+
+            if len(mids) >= 100:
+                glovar.delete_ids.pop(gid, None)
+            else:
+                mids = []
+
+        if mids:
+            cancel_delay(("delete_messages", gid))
+            return dispatch(delete_messages, (client, gid, mids))
+
+        result = delay(0.2, flush_messages, [client, gid], ("delete_messages", gid), keep=True)
     except Exception as e:
         logger.warning(f"Delete message error: {e}", exc_info=True)
 
     return result
 
 
+def flush_messages(client: Client, gid: int) -> bool:
+    # Delete the buffered messages of the group
+    result = False
+
+    try:
+        with glovar.locks["delete"]:
+            mids = glovar.delete_ids.pop(gid, [])
+
+        if not mids:
+            return True
+
+        result = dispatch(delete_messages, (client, gid, mids))
+    except Exception as e:
+        logger.warning(f"Flush messages error: {e}", exc_info=True)
+
+    return result
+
+
 def get_group(client: Client, gid: int, cache: bool = True) -> Optional[Chat]:
     # Get the group
     result = None
@@ -252,22 +283,22 @@ def leave_group(client: Client, gid: int, reason: str = "") -> bool:
         save("admin_ids")
 
         glovar.message_ids.pop(gid, {})
-        save("message_ids")
+        save("message_ids", gid)
 
         glovar.pinned_ids.pop(gid, {})
-        save("pinned_ids")
+        save("pinned_ids", gid)
 
         glovar.trust_ids.pop(gid, set())
         save("trust_ids")
 
         glovar.configs.pop(gid, {})
-        save("configs")
+        save("configs", gid)
 
         glovar.custom_texts.pop(gid, {})
         save("custom_texts")
 
         glovar.questions.pop(gid, {})
-        save("questions")
+        save("questions", gid)
 
         glovar.declared_message_ids.pop(gid, set())
 
@@ -18,14 +18,109 @@
 
 import logging
 from copy import deepcopy
+from heapq import heappop, heappush
+from typing import List
 
 from .. import glovar
+from ..status import UserStatus
+from .etc import get_now
 from .file import save
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+def add_deadline(uid: int, now: int = 0) -> bool:
+    # Schedule the next deadline of the user
+    result = False
+
+    try:
+        due = get_deadline(uid, now)
+
+        if not due:
+            return False
+
+        with glovar.deadline_condition:
+            scheduled = glovar.deadline_ids.get(uid, 0)
+
+            if scheduled and scheduled <= due:
+                return True
+
+            glovar.deadline_ids[uid] = due
+            heappush(glovar.deadlines, (due, uid))
+            glovar.deadlines[0] == (due, uid) and glovar.deadline_condition.notify()
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Add deadline error: {e}", exc_info=True)
+
+    return result
+
+
+def get_deadline(uid: int, now: int = 0) -> int:
+    # Get the next time that the user should be checked
+    result = 0
+
+    try:
+        user_status = glovar.user_ids.get(uid)
+
+        if not user_status:
+            return 0
+
+        dues = []
+
+        # Remove from the CAPTCHA group
+        time = user_status["time"]
+        time and dues.append(time + glovar.time_remove + 1)
+
+        # CAPTCHA timeout and qns timeout
+        for time in list(user_status.peek("wait").values()):
+            time and dues.append(time + ((glovar.time_captcha // 2) or 30) + 1)
+            time and dues.append(time + glovar.time_captcha + 1)
+
+        # Lift the ban
+        for time in list(user_status.peek("failed").values()):
+            time > 0 and dues.append(time + glovar.time_punish + 1)
+
+        future = [due for due in dues if due > now]
+        result = min(future, default=0)
+
+        # Some deadlines passed without action, such as in a flooded group, check them later
+        if len(future) < len(dues):
+            result = min(result or now + 60, now + 60)
+    except Exception as e:
+        logger.warning(f"Get deadline error: {e}", exc_info=True)
+
+    return result
+
+
+def get_due_users() -> List[int]:
+    # Wait for the next deadline, get the due users
+    result = []
+
+    try:
+        with glovar.deadline_condition:
+            now = get_now()
+
+            while not glovar.deadlines or glovar.deadlines[0][0] > now:
+                timeout = glovar.deadlines and glovar.deadlines[0][0] - now or None
+                glovar.deadline_condition.wait(timeout)
+                now = get_now()
+
+            while glovar.deadlines and glovar.deadlines[0][0] <= now:
+                due, uid = heappop(glovar.deadlines)
+
+                if glovar.deadline_ids.get(uid) != due:
+                    continue
+
+                glovar.deadline_ids.pop(uid, 0)
+                result.append(uid)
+    except Exception as e:
+        logger.warning(f"Get due users error: {e}", exc_info=True)
+
+    return result
+
+
 def init_group_id(gid: int) -> bool:
     # Init group data
     result = False
@@ -46,11 +141,11 @@ def init_group_id(gid: int) -> bool:
 
         if glovar.message_ids.get(gid) is None:
             glovar.message_ids[gid] = deepcopy(glovar.default_message_data)
-            save("message_ids")
+            save("message_ids", gid)
 
         if glovar.pinned_ids.get(gid) is None:
             glovar.pinned_ids[gid] = deepcopy(glovar.default_pinned_data)
-            save("pinned_ids")
+            save("pinned_ids", gid)
 
         if glovar.trust_ids.get(gid) is None:
             glovar.trust_ids[gid] = set()
@@ -58,7 +153,7 @@ def init_group_id(gid: int) -> bool:
 
         if glovar.configs.get(gid) is None:
             glovar.configs[gid] = deepcopy(glovar.default_config)
-            save("configs")
+            save("configs", gid)
 
         if glovar.custom_texts.get(gid) is None:
             glovar.custom_texts[gid] = deepcopy(glovar.default_custom_text)
@@ -66,7 +161,7 @@ def init_group_id(gid: int) -> bool:
 
         if glovar.questions.get(gid) is None:
             glovar.questions[gid] = deepcopy(glovar.default_question_data)
-            save("questions")
+            save("questions", gid)
 
         if glovar.declared_message_ids.get(gid) is None:
             glovar.declared_message_ids[gid] = set()
@@ -86,8 +181,8 @@ def init_user_id(uid: int) -> bool:
         if glovar.user_ids.get(uid) is not None:
             return True
 
-        glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
-        save("user_ids")
+        glovar.user_ids[uid] = UserStatus(uid, indexed=True)
+        save("user_ids", uid)
 
         result = True
     except Exception as e:
@@ -26,17 +26,21 @@ from pyrogram import Client
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
 
 from .. import glovar
+from ..special import get_special_dict, get_special_table
+from ..status import UserStatus, UserTable, drop_wait_index, get_user_records, get_wait_users, rebuild_wait_index
 from .challenge import send_static, user_captcha
 from .channel import get_debug_text, send_debug, share_data
 from .config import get_config_text
 from .decorators import threaded
-from .etc import (code, crypt_str, delay, general_link, get_int, get_now, get_text, lang, thread, mention_id,
-                  mention_text)
-from .file import crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, save
-from .filters import is_class_e_user, is_flooded, is_should_ignore
+from .etc import (code, crypt_str, delay, general_link, get_int, get_now, get_text, lang, thread,
+                  mention_id, mention_text)
+from .file import (crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, replace_table,
+                   save)
+from .filters import (is_class_e_user, is_flooded, is_should_ignore, update_regex_generation,
+                      update_regex_patterns)
 from .group import delete_message, leave_group
-from .ids import init_group_id, init_user_id
-from .telegram import (get_chat_member, get_chat_members_count, get_members, pin_chat_message, send_message,
+from .ids import add_deadline, init_group_id, init_user_id
+from .telegram import (dispatch, get_chat_member, get_chat_members_count, get_members, pin_chat_message, send_message,
                        send_report_message)
 from .timers import update_admins
 from .user import (flood_end, flood_user, forgive_user, forgive_users, kick_users, restrict_user, remove_failed_user,
@@ -72,7 +76,7 @@ def receive_add_bad(client: Client, data: dict) -> bool:
     return result
 
 
-@threaded()
+@threaded(pool="read")
 def receive_check_log(client: Client, message: Message, data: dict) -> bool:
     # Receive check log
     result = False
@@ -197,7 +201,9 @@ def receive_clear_data(client: Client, data_type: str, data: dict) -> bool:
         elif data_type == "user":
             if the_type == "all":
                 forgive_users(client)
-                glovar.user_ids = {}
+                drop_wait_index(glovar.user_ids)
+                glovar.user_ids.clear()
+                rebuild_wait_index(glovar.user_ids)
             elif the_type == "new":
                 remove_new_users()
 
@@ -228,7 +234,7 @@ def receive_clear_data(client: Client, data_type: str, data: dict) -> bool:
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('clear'))}\n"
                 f"{lang('more')}{lang('colon')}{code(f'{data_type} {the_type}')}\n")
-        result = thread(send_message, (client, glovar.debug_channel_id, text))
+        result = dispatch(send_message, (client, glovar.debug_channel_id, text))
     except Exception as e:
         logger.warning(f"Receive clear data: {e}", exc_info=True)
     finally:
@@ -248,7 +254,7 @@ def receive_config_commit(data: dict) -> bool:
 
         config["lock"] = get_now() - 300
         glovar.configs[gid] = config
-        save("configs")
+        save("configs", gid)
 
         result = True
     except Exception as e:
@@ -382,7 +388,7 @@ def receive_file_data(client: Client, message: Message, decrypt: bool = True) ->
             result = pickle.load(f)
 
         for f in {path, path_decrypted}:
-            thread(delete_file, (f,))
+            thread(delete_file, (f,), pool="disk")
     except Exception as e:
         logger.warning(f"Receive file error: {e}", exc_info=True)
 
@@ -543,7 +549,7 @@ def receive_help_confirm(client: Client, data: dict) -> bool:
         # Check confirm status
         if status != "end":
             glovar.pinned_ids[gid]["last"] = now
-            save("pinned_ids")
+            save("pinned_ids", gid)
             return True
 
         # Flood data
@@ -551,10 +557,10 @@ def receive_help_confirm(client: Client, data: dict) -> bool:
         last = glovar.pinned_ids[gid]["last"]
         new_id = glovar.pinned_ids[gid]["new_id"]
         old_id = glovar.pinned_ids[gid]["old_id"]
-        wait_user_list = [wid for wid in glovar.user_ids if glovar.user_ids[wid]["wait"].get(gid, 0)]
+        wait_user_list = get_wait_users(gid)
 
         # Pin old message
-        old_id and thread(pin_chat_message, (client, gid, old_id))
+        old_id and dispatch(pin_chat_message, (client, gid, old_id))
 
         # Delete newly pinned message
         new_id and delay(30, delete_message, [client, gid, new_id])
@@ -563,7 +569,7 @@ def receive_help_confirm(client: Client, data: dict) -> bool:
         # Reset time status
         glovar.pinned_ids[gid]["start"] = 0
         glovar.pinned_ids[gid]["last"] = 0
-        save("pinned_ids")
+        save("pinned_ids", gid)
 
         # Resend regular hint
         description = lang("description_hint").format(glovar.time_captcha)
@@ -650,7 +656,7 @@ def receive_leave_approve(client: Client, data: dict) -> bool:
             text += f"{lang('reason')}{lang('colon')}{code(reason)}\n"
 
         leave_group(client, the_id)
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        dispatch(send_message, (client, glovar.debug_channel_id, text))
 
         result = True
     except Exception as e:
@@ -674,7 +680,7 @@ def receive_refresh(client: Client, data: int) -> bool:
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('refresh'))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        dispatch(send_message, (client, glovar.debug_channel_id, text))
 
         result = True
     except Exception as e:
@@ -712,27 +718,18 @@ def receive_regex(client: Client, message: Message, data: str) -> bool:
 
         save(file_name)
 
+        # Replace the compiled rules, the cached name verdicts are dropped with them
+        update_regex_patterns(word_type)
+
         # Regenerate special characters dictionary if possible
         if file_name not in {"spc_words", "spe_words"}:
             return False
 
         special = file_name.split("_")[0]
-        exec(f"glovar.{special}_dict = {{}}")
-
-        for rule in words_data:
-            # Check keys
-            if "[" not in rule:
-                continue
-
-            # Check value
-            if "?#" not in rule:
-                continue
-
-            keys = rule.split("]")[0][1:]
-            value = rule.split("?#")[1][1]
-
-            for k in keys:
-                eval(f"glovar.{special}_dict")[k] = value
+        eval(f"glovar.{special}_dict").clear()
+        eval(f"glovar.{special}_dict").update(get_special_dict(words_data))
+        glovar.special_table = get_special_table(glovar.spc_dict, glovar.spe_dict)
+        update_regex_generation()
 
         result = True
     except Exception as e:
@@ -769,8 +766,9 @@ def receive_remove_bad(client: Client, data: dict) -> bool:
 
         forgive_user(client, the_id)
 
-        glovar.user_ids[the_id] = deepcopy(glovar.default_user_status)
-        save("user_ids")
+        glovar.user_ids[the_id]["wait"].clear()
+        glovar.user_ids[the_id] = UserStatus(the_id, indexed=True)
+        save("user_ids", the_id)
 
         result = True
     except Exception as e:
@@ -796,8 +794,9 @@ def receive_remove_score(client: Client, data: int) -> bool:
 
         forgive_user(client, uid)
 
-        glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
-        save("user_ids")
+        glovar.user_ids[uid]["wait"].clear()
+        glovar.user_ids[uid] = UserStatus(uid, indexed=True)
+        save("user_ids", uid)
 
         result = True
     except Exception as e:
@@ -863,15 +862,48 @@ def receive_rollback(client: Client, message: Message, data: dict) -> bool:
         if the_data is None:
             return False
 
-        exec(f"glovar.{the_type} = the_data")
-        save(the_type)
+        if the_type == "user_ids":
+            the_data = get_user_records(the_data)
+
+        # Replace the whole table in one transaction, the records are read from it again later
+        if the_type == "user_ids" and glovar.storage == "sqlite":
+            with glovar.locks["flush"]:
+                the_data = UserTable(glovar.sqlite_connection, glovar.locks["flush"], the_data)
+
+                if not replace_table(the_type, the_data):
+                    return False
+
+                drop_wait_index(glovar.user_ids)
+                glovar.user_ids = the_data
+        else:
+            the_type == "user_ids" and drop_wait_index(glovar.user_ids)
+            exec(f"glovar.{the_type} = the_data")
+            save(the_type)
+
+        # Replace the compiled rules and the special characters table, the cached name verdicts are dropped with them
+        if the_type.endswith("_words"):
+            with glovar.locks["regex"]:
+                update_regex_patterns(the_type[:-len("_words")])
+
+                if the_type in {"spc_words", "spe_words"}:
+                    glovar.spc_dict = get_special_dict(glovar.spc_words)
+                    glovar.spe_dict = get_special_dict(glovar.spe_words)
+                    glovar.special_table = get_special_table(glovar.spc_dict, glovar.spe_dict)
+                    update_regex_generation()
+
+        # Update the wait index and the deadlines
+        if the_type == "user_ids":
+            rebuild_wait_index(glovar.user_ids)
+
+            for uid in list(glovar.user_ids):
+                add_deadline(uid)
 
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('rollback'))}\n"
                 f"{lang('more')}{lang('colon')}{code(the_type)}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        dispatch(send_message, (client, glovar.debug_channel_id, text))
 
         result = True
     except Exception as e:
@@ -913,7 +945,7 @@ def receive_user_score(project: str, data: dict) -> bool:
 
         score = data["score"]
         glovar.user_ids[uid]["score"][project] = score
-        save("user_ids")
+        save("user_ids", uid)
 
         result = True
     except Exception as e:
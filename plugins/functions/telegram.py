@@ -17,27 +17,222 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from typing import Generator, Iterable, List, Optional, Union
+from asyncio import run_coroutine_threadsafe, sleep
+from concurrent.futures import Future
+from functools import wraps
+from time import monotonic
+from typing import Any, BinaryIO, Callable, Dict, Generator, Iterable, List, Optional, Tuple, Union
 
 from pyrogram import Client
 from pyrogram.types import (InputMediaPhoto, InlineKeyboardMarkup, ReplyKeyboardMarkup, Message, Chat, ChatMember,
-                            ChatPermissions, ChatPreview, User)
+                            ChatPermissions, ChatPreview, Photo, User)
 from pyrogram.raw.base import InputChannel, InputUser, InputPeer
+from pyrogram.raw.functions.messages import UploadMedia
 from pyrogram.raw.functions.users import GetFullUser
-from pyrogram.raw.types import InputPeerUser, InputPeerChannel, UserFull
+from pyrogram.raw.types import InputMediaUploadedPhoto, InputPeerUser, InputPeerChannel, UserFull
 from pyrogram.errors import (ChatAdminRequired, ChatNotModified, ButtonDataInvalid, ButtonUrlInvalid, ChannelInvalid,
-                             ChannelPrivate, FloodWait, MessageDeleteForbidden, MessageNotModified, PeerIdInvalid,
-                             QueryIdInvalid, UsernameInvalid, UsernameNotOccupied, UserNotParticipant)
+                             ChannelPrivate, FileIdInvalid, FileReferenceEmpty, FileReferenceExpired,
+                             FileReferenceInvalid, FloodWait, MediaEmpty, MediaInvalid, MessageDeleteForbidden,
+                             MessageNotModified, PeerIdInvalid, PhotoIdInvalid, QueryIdInvalid, UsernameInvalid,
+                             UsernameNotOccupied, UserNotParticipant)
 
 from .. import glovar
+from ..workers import priority_high, priority_low, priority_normal
 from .decorators import retry, threaded
-from .etc import delay, get_int, wait_flood
+from .etc import delay, get_int, thread
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
+# The errors of a file id that can not be used again, the file should be uploaded again
+file_errors = (FileIdInvalid, FileReferenceEmpty, FileReferenceExpired, FileReferenceInvalid, MediaEmpty, MediaInvalid,
+               PhotoIdInvalid)
+
+# The result of a photo call that failed with one of the file errors
+file_invalid = ""
+
+
+def add_flood(cid: int, secs: int) -> bool:
+    # Let all calls to the chat wait for the flood, the chat 0 means all calls
+    result = False
+
+    try:
+        with glovar.bucket_condition:
+            bucket = get_bucket(cid, monotonic())
+            bucket[0] = 0.0
+            bucket[2] = max(bucket[2], bucket[1] + secs)
+            glovar.bucket_condition.notify_all()
+
+        logger.warning(f"Flood in {cid or 'all chats'} - Hold the calls for {secs} second(s)")
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Add flood error: {e}", exc_info=True)
+
+    return result
+
+
+def get_bucket(cid: int, now: float) -> List[float]:
+    # Get the refilled token bucket of the chat, the caller holds the bucket condition
+    result = []
+
+    try:
+        if cid:
+            capacity, rate = glovar.limit_chat, glovar.limit_chat / 60
+        else:
+            capacity, rate = glovar.limit_send, glovar.limit_send
+
+        result = glovar.buckets.setdefault(cid, [float(capacity), now, 0.0])
+        result[0] = min(capacity, result[0] + (now - result[1]) * rate)
+        result[1] = now
+    except Exception as e:
+        logger.warning(f"Get bucket error: {e}", exc_info=True)
+
+    return result
+
+
+def get_hold(cid: int) -> float:
+    # Get the seconds that the calls to the chat are still held by a flood
+    result = 0.0
+
+    try:
+        with glovar.bucket_condition:
+            now = monotonic()
+            holds = [bucket[2] - now for bucket in (glovar.buckets.get(0), glovar.buckets.get(cid)) if bucket]
+            result = max(holds + [0.0])
+    except Exception as e:
+        logger.warning(f"Get hold error: {e}", exc_info=True)
+
+    return result
+
+
+def get_priority(cid: int, level: int) -> int:
+    # Get the priority of a call, questions go first, logs go last
+    result = level
+
+    try:
+        if not cid:
+            return level
+
+        if cid == glovar.captcha_group_id:
+            return priority_high
+
+        if cid in {glovar.critical_channel_id, glovar.debug_channel_id, glovar.exchange_channel_id,
+                   glovar.hide_channel_id, glovar.logging_channel_id}:
+            return priority_low
+    except Exception as e:
+        logger.warning(f"Get priority error: {e}", exc_info=True)
+
+    return result
+
+
+def limited(level: int = priority_normal, chat: bool = True, send: bool = False):
+    # Take a token before the call, the second argument is the chat if chat is True,
+    # sending calls also take a token of the chat, a FloodWait holds the calls of the chat
+    def decorator(func: Callable):
+        @wraps(func)
+        def wrapper(*args, priority: int = None, **kwargs):
+            cid = args[1] if len(args) > 1 else kwargs.get("cid")
+            key = cid if chat and isinstance(cid, int) else 0
+            take_token(key, get_priority(key, level if priority is None else priority), send)
+
+            try:
+                return func(*args, **kwargs)
+            except FloodWait as e:
+                add_flood(key, e.x)
+                e.limited = True
+                raise e
+        return wrapper
+    return decorator
+
+
+def leave_token(level: int) -> bool:
+    # Stop waiting for the global bucket without a token
+    result = False
+
+    try:
+        with glovar.bucket_condition:
+            glovar.bucket_waiting[level] -= 1
+            glovar.bucket_condition.notify_all()
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Leave token error: {e}", exc_info=True)
+
+    return result
+
+
+def take_token(cid: int, level: int, send: bool) -> bool:
+    # Wait for a token of the global bucket, and a token of the chat bucket if sending
+    result = False
+
+    try:
+        with glovar.bucket_condition:
+            waiting = False
+
+            try:
+                while True:
+                    timeout, waiting = try_token(cid, level, send, waiting)
+
+                    if not timeout:
+                        break
+
+                    glovar.bucket_condition.wait(timeout)
+            finally:
+                waiting and leave_token(level)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Take token error: {e}", exc_info=True)
+
+    return result
+
+
+def try_token(cid: int, level: int, send: bool, waiting: bool = False, blocking: bool = True) -> Tuple[float, bool]:
+    # Take the tokens without waiting, get the seconds to wait if they are not available,
+    # and whether the call is counted as waiting for the global bucket now,
+    # only the calls whose chat is ready hold back the lower priorities,
+    # without blocking a busy lock is tried again soon, the call is not limited on errors
+    timeout = 0.0
+
+    if not glovar.bucket_condition.acquire(blocking):
+        return 0.01, waiting
+
+    try:
+        now = monotonic()
+        total = get_bucket(0, now)
+        bucket = cid and get_bucket(cid, now)
+        delays = [total[2] - now]
+        bucket and delays.append(bucket[2] - now)
+        bucket and send and delays.append((1 - bucket[0]) * 60 / glovar.limit_chat)
+        ready = max(delays) <= 0
+
+        if ready != waiting:
+            waiting = ready
+            glovar.bucket_waiting[level] += 1 if waiting else -1
+
+        if ready and total[0] >= 1 and not any(glovar.bucket_waiting[:level]):
+            total[0] -= 1
+
+            if bucket and send:
+                bucket[0] -= 1
+
+            glovar.bucket_waiting[level] -= 1
+            glovar.bucket_condition.notify_all()
+
+            return 0.0, False
+
+        timeout = max(max(delays), (1 - total[0]) / glovar.limit_send, 0.01)
+    except Exception as e:
+        logger.warning(f"Try token error: {e}", exc_info=True)
+    finally:
+        glovar.bucket_condition.release()
+
+    return timeout, waiting
+
 
 @retry
+@limited(priority_high, chat=False)
 def answer_callback(client: Client, callback_query_id: str, text: str, show_alert: bool = False) -> Optional[bool]:
     # Answer the callback
     result = None
@@ -77,6 +272,7 @@ def delete_messages(client: Client, cid: int, mids: Iterable[int]) -> Optional[b
 
 
 @retry
+@limited()
 def delete_messages_100(client: Client, cid: int, mids: Iterable[int]) -> Optional[bool]:
     # Delete some messages
     result = None
@@ -95,6 +291,7 @@ def delete_messages_100(client: Client, cid: int, mids: Iterable[int]) -> Option
 
 
 @retry
+@limited(chat=False)
 def download_media(client: Client, file_id: str, file_path: str) -> Optional[str]:
     # Download a media file
     result = None
@@ -110,12 +307,20 @@ def download_media(client: Client, file_id: str, file_path: str) -> Optional[str
 
 
 @retry
-def edit_message_photo(client: Client, cid: int, mid: int, photo: str, caption: str = "",
-                       markup: InlineKeyboardMarkup = None) -> Union[bool, Message, None]:
+@limited(send=True)
+def edit_message_photo(client: Client, cid: int, mid: int, photo: Union[str, BinaryIO], caption: str = "",
+                       markup: InlineKeyboardMarkup = None) -> Union[bool, Message, str, None]:
     # Edit the message's photo
     result = None
 
     try:
+        # Input media only accepts a path or a file id, the upload uses the token of this call
+        if not isinstance(photo, str):
+            photo = upload_photo(client, cid, photo)
+
+        if not photo:
+            return None
+
         media = InputMediaPhoto(
             media=photo,
             caption=caption,
@@ -131,6 +336,9 @@ def edit_message_photo(client: Client, cid: int, mid: int, photo: str, caption:
         raise e
     except (ButtonDataInvalid, ButtonUrlInvalid):
         logger.warning(f"Edit message {mid} photo {photo} in {cid} - invalid markup: {markup}")
+    except file_errors as e:
+        logger.warning(f"Edit message {mid} photo {photo} in {cid} - invalid file: {e}")
+        return file_invalid
     except (ChannelInvalid, ChannelPrivate, ChatAdminRequired, PeerIdInvalid):
         return False
     except Exception as e:
@@ -140,6 +348,7 @@ def edit_message_photo(client: Client, cid: int, mid: int, photo: str, caption:
 
 
 @retry
+@limited(send=True)
 def edit_message_reply_markup(client: Client, cid: int, mid: int,
                               markup: InlineKeyboardMarkup = None) -> Union[bool, Message, None]:
     # Edit the message's reply markup
@@ -166,6 +375,7 @@ def edit_message_reply_markup(client: Client, cid: int, mid: int,
 
 
 @retry
+@limited(send=True)
 def edit_message_text(client: Client, cid: int, mid: int, text: str,
                       markup: InlineKeyboardMarkup = None) -> Union[bool, Message, None]:
     # Edit the message's text
@@ -198,6 +408,7 @@ def edit_message_text(client: Client, cid: int, mid: int, text: str,
 
 
 @retry
+@limited()
 def export_chat_invite_link(client: Client, cid: int) -> Union[bool, str, None]:
     # Generate a new link for a chat
     result = None
@@ -216,6 +427,7 @@ def export_chat_invite_link(client: Client, cid: int) -> Union[bool, str, None]:
 
 
 @retry
+@limited(send=True)
 def forward_messages(client: Client, cid: int, fid: int,
                      mids: Union[int, Iterable[int]]) -> Union[bool, Message, List[Message], None]:
     # Forward messages of any kind
@@ -239,6 +451,7 @@ def forward_messages(client: Client, cid: int, fid: int,
 
 
 @retry
+@limited()
 def get_admins(client: Client, cid: int) -> Union[bool, List[ChatMember], None]:
     # Get a group's admins
     result = None
@@ -261,6 +474,7 @@ def get_admins(client: Client, cid: int) -> Union[bool, List[ChatMember], None]:
 
 
 @retry
+@limited()
 def get_chat(client: Client, cid: Union[int, str]) -> Union[Chat, ChatPreview, None]:
     # Get a chat
     result = None
@@ -278,6 +492,7 @@ def get_chat(client: Client, cid: Union[int, str]) -> Union[Chat, ChatPreview, N
 
 
 @retry
+@limited()
 def get_chat_member(client: Client, cid: int, uid: int) -> Union[bool, ChatMember, None]:
     # Get information about one member of a chat
     result = None
@@ -295,6 +510,7 @@ def get_chat_member(client: Client, cid: int, uid: int) -> Union[bool, ChatMembe
 
 
 @retry
+@limited()
 def get_chat_members_count(client: Client, cid: int) -> Optional[int]:
     # Get the number of members in a chat
     result = None
@@ -343,6 +559,7 @@ def get_group_info(client: Client, chat: Union[int, Chat], cache: bool = True) -
 
 
 @retry
+@limited(chat=False)
 def get_me(client: Client) -> Optional[User]:
     # Get myself
     result = None
@@ -358,6 +575,7 @@ def get_me(client: Client) -> Optional[User]:
 
 
 @retry
+@limited()
 def get_members(client: Client, cid: int, query: str = "all") -> Optional[Generator[ChatMember, None, None]]:
     # Get a members generator of a chat
     result = None
@@ -373,6 +591,7 @@ def get_members(client: Client, cid: int, query: str = "all") -> Optional[Genera
 
 
 @retry
+@limited()
 def get_messages(client: Client, cid: int, mids: Union[int, Iterable[int]]) -> Union[Message, List[Message], None]:
     # Get some messages
     result = None
@@ -407,6 +626,7 @@ def get_start(client: Client, para: str) -> str:
 
 
 @retry
+@limited(chat=False)
 def get_user_full(client: Client, uid: int) -> Optional[UserFull]:
     # Get a full user
     result = None
@@ -426,6 +646,7 @@ def get_user_full(client: Client, uid: int) -> Optional[UserFull]:
     return result
 
 
+@limited(priority_high)
 def kick_chat_member(client: Client, cid: int, uid: Union[int, str],
                      until_date: int = 0) -> Union[bool, Message, None]:
     # Kick a chat member in a group
@@ -434,14 +655,12 @@ def kick_chat_member(client: Client, cid: int, uid: Union[int, str],
     try:
         result = client.kick_chat_member(chat_id=cid, user_id=uid, until_date=until_date)
     except FloodWait as e:
-        logger.warning(f"Kick chat member {uid} in {cid} - Sleep for {e.x} second(s)")
-
         if until_date:
             new_date = until_date + e.x
         else:
             new_date = 0
 
-        wait_flood(e)
+        add_flood(cid, e.x)
 
         return kick_chat_member(client, cid, uid, new_date)
     except PeerIdInvalid:
@@ -453,6 +672,7 @@ def kick_chat_member(client: Client, cid: int, uid: Union[int, str],
 
 
 @retry
+@limited()
 def leave_chat(client: Client, cid: int, delete: bool = False) -> bool:
     # Leave a channel
     result = False
@@ -470,6 +690,7 @@ def leave_chat(client: Client, cid: int, delete: bool = False) -> bool:
 
 
 @retry
+@limited(send=True)
 def pin_chat_message(client: Client, cid: int, mid: int) -> Optional[bool]:
     # Pin a message in a group, channel or your own chat
     result = None
@@ -550,6 +771,7 @@ def resolve_username(client: Client, username: str, cache: bool = True) -> (str,
 
 
 @retry
+@limited(priority_high)
 def restrict_chat_member(client: Client, cid: int, uid: int, permissions: ChatPermissions,
                          until_date: int = 0) -> Optional[Chat]:
     # Restrict a user in a supergroup
@@ -563,14 +785,12 @@ def restrict_chat_member(client: Client, cid: int, uid: int, permissions: ChatPe
             until_date=until_date
         )
     except FloodWait as e:
-        logger.warning(f"Restrict chat member {uid} in {cid} - Sleep for {e.x} second(s)")
-
         if until_date:
             new_date = until_date + e.x
         else:
             new_date = 0
 
-        wait_flood(e)
+        add_flood(cid, e.x)
 
         return restrict_chat_member(client, cid, uid, permissions, new_date)
     except Exception as e:
@@ -580,6 +800,7 @@ def restrict_chat_member(client: Client, cid: int, uid: int, permissions: ChatPe
 
 
 @retry
+@limited(send=True)
 def send_document(client: Client, cid: int, document: str, caption: str = "", mid: int = None,
                   markup: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup] = None) -> Union[bool, Message, None]:
     # Send a document to a chat
@@ -607,6 +828,7 @@ def send_document(client: Client, cid: int, document: str, caption: str = "", mi
 
 
 @retry
+@limited(send=True)
 def send_message(client: Client, cid: int, text: str, mid: int = None,
                  markup: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup] = None) -> Union[bool, Message, None]:
     # Send a message to a chat
@@ -637,13 +859,14 @@ def send_message(client: Client, cid: int, text: str, mid: int = None,
 
 
 @retry
-def send_photo(client: Client, cid: int, photo: str, caption: str = "", mid: int = None,
-               markup: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup] = None) -> Union[bool, Message, None]:
+@limited(send=True)
+def send_photo(client: Client, cid: int, photo: Union[str, BinaryIO], caption: str = "", mid: int = None,
+               markup: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup] = None) -> Union[bool, Message, str, None]:
     # Send a photo to a chat
     result = None
 
     try:
-        if not photo.strip():
+        if isinstance(photo, str) and not photo.strip():
             return None
 
         result = client.send_photo(
@@ -658,6 +881,9 @@ def send_photo(client: Client, cid: int, photo: str, caption: str = "", mid: int
         raise e
     except (ButtonDataInvalid, ButtonUrlInvalid):
         logger.warning(f"Send photo {photo} to {cid} - invalid markup: {markup}")
+    except file_errors as e:
+        logger.warning(f"Send photo {photo} to {cid} - invalid file: {e}")
+        return file_invalid
     except (ChannelInvalid, ChannelPrivate, ChatAdminRequired, PeerIdInvalid):
         return False
     except Exception as e:
@@ -666,7 +892,7 @@ def send_photo(client: Client, cid: int, photo: str, caption: str = "", mid: int
     return result
 
 
-@threaded()
+@threaded(priority=priority_low)
 def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int = None,
                         markup: InlineKeyboardMarkup = None) -> Optional[bool]:
     # Send a message that will be auto deleted to a chat
@@ -678,7 +904,8 @@ def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int
             cid=cid,
             text=text,
             mid=mid,
-            markup=markup
+            markup=markup,
+            priority=priority_low
         )
 
         if not result:
@@ -694,6 +921,7 @@ def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int
 
 
 @retry
+@limited(priority_high)
 def unban_chat_member(client: Client, cid: int, uid: Union[int, str]) -> Optional[bool]:
     # Unban a user in a group
     result = None
@@ -706,3 +934,124 @@ def unban_chat_member(client: Client, cid: int, uid: Union[int, str]) -> Optiona
         logger.warning(f"Unban chat member {uid} in {cid} error: {e}", exc_info=True)
 
     return result
+
+
+def upload_photo(client: Client, cid: int, photo: BinaryIO) -> str:
+    # Upload a photo in memory for the chat, get its file id,
+    # not limited, the caller has taken the token of the whole edit
+    result = ""
+
+    try:
+        media = client.send(
+            UploadMedia(
+                peer=client.resolve_peer(cid),
+                media=InputMediaUploadedPhoto(file=client.save_file(photo))
+            )
+        )
+        result = Photo._parse(client, media.photo).file_id
+    except FloodWait as e:
+        raise e
+    except Exception as e:
+        logger.warning(f"Upload photo to {cid} error: {e}", exc_info=True)
+
+    return result
+
+
+async def call_async(client: Client, cid: int, level: int, send: bool, method: str, **kwargs) -> Any:
+    # Call a Bot API method on the event loop, limited by the same buckets as the sync calls,
+    # the loop never waits for the bucket lock, a flood is added in the default executor
+    result = None
+    level = get_priority(cid, level)
+    waiting = False
+
+    try:
+        while True:
+            timeout, waiting = try_token(cid, level, send, waiting, False)
+
+            if timeout:
+                await sleep(timeout)
+                continue
+
+            try:
+                return await getattr(type(client), method).__wrapped__(client, **kwargs)
+            except FloodWait as e:
+                await client.loop.run_in_executor(None, add_flood, cid, e.x)
+    except (ButtonDataInvalid, ButtonUrlInvalid, ChannelInvalid, ChannelPrivate, ChatAdminRequired, ChatNotModified,
+            MessageDeleteForbidden, MessageNotModified, PeerIdInvalid, QueryIdInvalid):
+        return False
+    except Exception as e:
+        logger.warning(f"Call {method} in {cid} error: {e}", exc_info=True)
+    finally:
+        waiting and client.loop.run_in_executor(None, leave_token, level)
+
+    return result
+
+
+# The fire-and-forget calls that can run on the event loop, only these go there, the handlers, the other wrappers
+# and glovar.locks stay synchronous, each target has the Bot API method, the level, whether it is a sending call,
+# the names of the wrapper's arguments after the client, and the fixed arguments of the wrapper
+async_targets: Dict[Callable, Tuple[str, int, bool, Tuple[str, ...], Dict[str, Any]]] = {
+    answer_callback: ("answer_callback_query", priority_high, False, ("callback_query_id", "text", "show_alert"), {}),
+    delete_messages_100: ("delete_messages", priority_normal, False, ("chat_id", "message_ids"), {}),
+    edit_message_reply_markup: ("edit_message_reply_markup", priority_normal, True,
+                                ("chat_id", "message_id", "reply_markup"), {}),
+    edit_message_text: ("edit_message_text", priority_normal, True, ("chat_id", "message_id", "text", "reply_markup"),
+                        {"parse_mode": "html", "disable_web_page_preview": True}),
+    pin_chat_message: ("pin_chat_message", priority_normal, True, ("chat_id", "message_id"),
+                       {"disable_notification": True}),
+    send_message: ("send_message", priority_normal, True, ("chat_id", "text", "reply_to_message_id", "reply_markup"),
+                   {"parse_mode": "html", "disable_web_page_preview": True})
+}
+
+
+def dispatch(target: Callable, args: tuple) -> bool:
+    # Call a wrapper without waiting for it, on the event loop in the async mode, or in the worker pool by priority,
+    # a call to a chat held by a flood is tried again later instead of waiting in a worker
+    result = False
+
+    try:
+        if (not glovar.async_calls or (target not in async_targets and target is not delete_messages)
+                or not args[0].loop.is_running()):
+            cid = args[1] if len(args) > 1 and isinstance(args[1], int) else 0
+            hold = get_hold(cid)
+
+            if hold > 0:
+                return delay(hold, dispatch, [target, args])
+
+            return thread(target, args, priority=get_priority(cid, priority_normal))
+
+        # Delete the messages by 100 as the sync wrapper does
+        if target is delete_messages:
+            mids = list(args[2])
+            return all([dispatch(delete_messages_100, (args[0], args[1], mids[i:i + 100]))
+                        for i in range(0, len(mids), 100)])
+
+        method, level, send, names, fixed = async_targets[target]
+        kwargs = dict(zip(names, args[1:]), **fixed)
+
+        # Skip an empty text like the sync wrappers
+        if "text" in kwargs and not kwargs["text"].strip():
+            return False
+
+        cid = kwargs.get("chat_id", 0)
+        future = run_coroutine_threadsafe(call_async(args[0], cid, level, send, method, **kwargs), args[0].loop)
+        future.add_done_callback(dispatch_done)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Dispatch error: {e}", exc_info=True)
+
+    return result
+
+
+def dispatch_done(future: Future) -> bool:
+    # Log the error of a dispatched call
+    result = False
+
+    try:
+        future.exception() and logger.warning(f"Dispatched call error: {future.exception()}")
+        result = True
+    except Exception as e:
+        logger.warning(f"Dispatch done error: {e}", exc_info=True)
+
+    return result
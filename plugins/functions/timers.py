@@ -17,33 +17,47 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from copy import deepcopy
 from time import sleep
-from typing import Dict
+from typing import Dict, List
 
 from pyrogram import Client
 
 from .. import glovar
+from ..status import UserTable, check_wait_index, get_wait_count, get_wait_groups, rebuild_wait_index
+from ..workers import get_pool_stats
 from .channel import share_data, share_regex_count
 from .decorators import threaded
-from .etc import code, general_link, get_now, get_readable_time, lang, thread
-from .file import file_tsv, save
-from .filters import is_class_e_user, is_flooded
+from .etc import code, general_link, get_delay_count, get_now, get_readable_time, lang, t2s
+from .file import file_tsv, get_due_ids, save, save_file, save_flush
+from .filters import fold_regex_counts, get_name_verdict, is_class_e_user, is_flooded
 from .group import delete_hint, leave_group, save_admins
+from .ids import add_deadline, get_due_users
 from .telegram import export_chat_invite_link, get_admins, get_group_info
-from .telegram import get_members, send_message
+from .telegram import dispatch, get_members, send_message
 from .user import check_timeout_user, forgive_users, kick_user, lift_ban, remove_group_user, unban_user
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
-@threaded()
+@threaded(pool="exchange")
 def backup_files(client: Client) -> bool:
     # Backup data files to BACKUP
     result = False
 
     try:
+        # Save the dirty data first, compact the journals
+        fold_regex_counts()
+
+        for file in glovar.keyed_files:
+            glovar.storage == "journal" and save(file)
+
+        save_flush()
+
+        # Export the tables as files
+        for file in glovar.keyed_files:
+            glovar.storage == "sqlite" and save_file(file)
+
         for file in glovar.file_list:
             # Check
             if not eval(f"glovar.{file}"):
@@ -123,6 +137,32 @@ def clear_members(client: Client) -> bool:
     return result
 
 
+def deadline_worker(client: Client) -> bool:
+    # Check the users when their deadlines are due
+    result = False
+
+    try:
+        # Schedule the users
+        if glovar.storage == "sqlite" and "user_ids" not in glovar.save_dirty:
+            uid_list = set()
+
+            for column in glovar.sqlite_columns["user_ids"]:
+                uid_list |= get_due_ids("user_ids", column, 2 ** 62)
+        else:
+            uid_list = list(glovar.user_ids)
+
+        for uid in uid_list:
+            add_deadline(uid)
+
+        # Wait for the deadlines
+        while True:
+            process_deadlines(client, get_due_users())
+    except Exception as e:
+        logger.warning(f"Deadline worker error: {e}", exc_info=True)
+
+    return result
+
+
 def interval_hour_01() -> bool:
     # Execute every hour
     result = False
@@ -145,6 +185,28 @@ def interval_hour_01() -> bool:
 
         save("starts")
 
+        # Drop the idle user records that are saved in the table
+        if isinstance(glovar.user_ids, UserTable) and "user_ids" not in glovar.save_dirty:
+            with glovar.locks["save"]:
+                keep = set(glovar.save_keys.get("user_ids", set()))
+
+            logger.info(f"Evicted {glovar.user_ids.evict(keep)} user records")
+
+        # Log the save counts
+        logger.info(f"Save counts: {glovar.save_counts}")
+
+        # Log the worker pools and the delayed calls
+        logger.info(f"Worker pools: {get_pool_stats(glovar.pools)}")
+        logger.info(f"Delayed calls: {get_delay_count()} pending")
+
+        # Log the name verdict cache
+        info = get_name_verdict.cache_info()
+        logger.info(f"Name verdict cache: {info}, hit rate {info.hits / max(info.hits + info.misses, 1):.2%}")
+
+        # Log the conversion cache
+        info = t2s.cache_info()
+        logger.info(f"Conversion cache: {info}, hit rate {info.hits / max(info.hits + info.misses, 1):.2%}")
+
         result = True
     except Exception as e:
         logger.warning(f"Interval hour 01 error: {e}", exc_info=True)
@@ -164,19 +226,8 @@ def interval_min_01(client: Client) -> bool:
         # Basic data
         now = get_now()
 
-        # Check users
-        for uid in list(glovar.user_ids):
-            # Remove users from the CAPTCHA group
-            remove_group_user(client, uid, now)
-
-            # Terminate timeout users
-            check_timeout_user(client, uid, now)
-
-            # Lift the ban on users
-            lift_ban(client, uid, now)
-
-        # Save the user_ids
-        save("user_ids")
+        # Check the wait index
+        glovar.debug and check_wait_index(glovar.user_ids)
 
         # Clear changed ids
         glovar.changed_ids = set()
@@ -200,10 +251,8 @@ def interval_min_01(client: Client) -> bool:
                 continue
 
             # Get group's waiting user list
-            wait_user_list = [wid for wid in glovar.user_ids if glovar.user_ids[wid]["wait"].get(gid, 0)]
-
             # Flood situation ongoing
-            if len(wait_user_list) > glovar.limit_flood:
+            if get_wait_count(gid) > glovar.limit_flood:
                 continue
 
             # Ask for help
@@ -248,6 +297,9 @@ def interval_min_10(client: Client) -> bool:
         # New invite link
         new_invite_link(client)
 
+        # Save the regex counts
+        fold_regex_counts()
+
         result = True
     except Exception as e:
         logger.warning(f"Interval min 10 error: {e}", exc_info=True)
@@ -269,12 +321,8 @@ def new_invite_link(client: Client, force: bool = False) -> bool:
         if not force and any(is_flooded(gid) for gid in list(glovar.configs)):
             return False
 
-        # Copy the data
-        with glovar.locks["message"]:
-            user_ids = deepcopy(glovar.user_ids)
-
         # Check if there is a waiting
-        if not force and any(user_ids[uid]["wait"] for uid in user_ids):
+        if not force and get_wait_groups():
             return False
 
         # Check the link time
@@ -305,6 +353,44 @@ def new_invite_link(client: Client, force: bool = False) -> bool:
     return result
 
 
+def process_deadlines(client: Client, uids: List[int]) -> bool:
+    # Check the users whose deadlines are due
+    result = False
+
+    if not uids:
+        return False
+
+    glovar.locks["message"].acquire()
+
+    try:
+        # Basic data
+        now = get_now()
+
+        for uid in uids:
+            if not glovar.user_ids.get(uid):
+                continue
+
+            # Remove users from the CAPTCHA group
+            remove_group_user(client, uid, now)
+
+            # Terminate timeout users
+            check_timeout_user(client, uid, now)
+
+            # Lift the ban on users
+            lift_ban(client, uid, now)
+
+            # Schedule the next deadline
+            add_deadline(uid, now)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Process deadlines error: {e}", exc_info=True)
+    finally:
+        glovar.locks["message"].release()
+
+    return result
+
+
 def reset_data(client: Client) -> bool:
     # Reset user data every month
     result = False
@@ -330,7 +416,8 @@ def reset_data(client: Client) -> bool:
         save("left_group_ids")
 
         forgive_users(client)
-        glovar.user_ids = {}
+        glovar.user_ids.clear()
+        rebuild_wait_index(glovar.user_ids)
         save("user_ids")
 
         glovar.watch_ids = {
@@ -342,7 +429,7 @@ def reset_data(client: Client) -> bool:
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('reset'))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        dispatch(send_message, (client, glovar.debug_channel_id, text))
 
         result = True
     except Exception as e:
@@ -357,6 +444,8 @@ def send_count(client: Client) -> bool:
     # Send regex count to REGEX
     result = False
 
+    fold_regex_counts()
+
     glovar.locks["regex"].acquire()
 
     try:
@@ -378,7 +467,7 @@ def send_count(client: Client) -> bool:
     return result
 
 
-@threaded()
+@threaded(pool="exchange")
 def share_failed_users(client: Client, data: Dict[str, int] = None) -> bool:
     # Share failed users
     result = False
@@ -476,7 +565,7 @@ def update_admins(client: Client) -> bool:
                               f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
                               f"{lang('status')}{lang('colon')}{code(lang('leave_auto'))}\n"
                               f"{lang('reason')}{lang('colon')}{code(lang('reason_leave'))}\n")
-                thread(send_message, (client, glovar.debug_channel_id, debug_text))
+                dispatch(send_message, (client, glovar.debug_channel_id, debug_text))
                 continue
 
             # Check the admin list
@@ -525,7 +614,7 @@ def update_admins(client: Client) -> bool:
                           f"{lang('group_name')}{lang('colon')}{general_link(group_name, group_link)}\n"
                           f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
                           f"{lang('status')}{lang('colon')}{code(reason)}\n")
-            thread(send_message, (client, glovar.debug_channel_id, debug_text))
+            dispatch(send_message, (client, glovar.debug_channel_id, debug_text))
 
         result = True
     except Exception as e:
@@ -25,15 +25,17 @@ from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message,
 from pyrogram.raw.types import User
 
 from .. import glovar
+from ..status import get_all_uids
+from ..workers import priority_high
 from .channel import ask_for_help, ask_help_welcome, declare_message, send_debug, share_data, update_score
 from .command import get_command_type
 from .decorators import threaded
 from .etc import code, delay, get_int, get_now, get_readable_time, get_text, lang, mention_text, random_str, thread
-from .file import data_to_file, file_tsv, save
+from .file import data_to_file, edit_cached_photo, file_tsv, save
 from .filters import is_class_d_user, is_flooded, is_from_user, is_should_qns
 from .group import delete_hint, delete_message
-from .ids import init_user_id
-from .telegram import answer_callback, edit_message_photo, edit_message_text, get_messages, get_user_full
+from .ids import add_deadline, init_user_id
+from .telegram import answer_callback, dispatch, edit_message_text, get_messages, get_user_full
 from .telegram import kick_chat_member, resolve_username, restrict_chat_member, unban_chat_member
 
 # Enable logging
@@ -66,7 +68,7 @@ def add_start(until: int, cid: int, uid: int, action: str) -> str:
     return result
 
 
-@threaded()
+@threaded(priority=priority_high)
 def ban_user(client: Client, gid: int, uid: Union[int, str], lock: bool = False) -> bool:
     # Ban a user
     result = False
@@ -94,15 +96,15 @@ def change_member_status(client: Client, level: str, gid: int, uid: int,
 
         if level == "ban":
             glovar.user_ids[uid]["banned"].add(gid)
-            save("user_ids")
+            save("user_ids", uid)
             ban_user(client, gid, uid)
         elif level == "restrict":
             glovar.user_ids[uid]["restricted"].add(gid)
-            save("user_ids")
+            save("user_ids", uid)
             restrict_user(client, gid, uid)
         elif level == "kick":
             ban_user(client, gid, uid, lock)
-            record and glovar.user_ids[uid]["banned"].add(gid) and save("user_ids")
+            record and glovar.user_ids[uid]["banned"].add(gid) and save("user_ids", uid)
 
         result = True
     except Exception as e:
@@ -166,7 +168,7 @@ def check_timeout_user(client: Client, uid: int, now: int) -> bool:
     return result
 
 
-@threaded()
+@threaded(pool="slow")
 def failed_user(client: Client, uid: int, reason: str) -> bool:
     # Log failed user info
     result = False
@@ -209,7 +211,7 @@ def failed_user(client: Client, uid: int, reason: str) -> bool:
     return result
 
 
-@threaded()
+@threaded(pool="slow")
 def flood_end(client: Client, gid: int, manual: bool = False) -> bool:
     # Flood end, terminate users
     result = False
@@ -293,10 +295,10 @@ def flood_end(client: Client, gid: int, manual: bool = False) -> bool:
             failed_count = len(glovar.user_ids[uid]["failed"])
             score = pass_count * -0.2 + succeeded_count * -0.3 + failed_count * 0.6
             glovar.user_ids[uid]["score"][glovar.sender.lower()] = score
+            save("user_ids", uid)
 
             users[uid] = score
 
-        save("user_ids")
         file = data_to_file(users)
         not manual and share_data(
             client=client,
@@ -417,7 +419,7 @@ def forgive_users(client: Client) -> bool:
     result = False
 
     try:
-        result = bool([forgive_user(client, uid, True) for uid in list(glovar.user_ids)])
+        result = bool([forgive_user(client, uid, True) for uid in get_all_uids(glovar.user_ids)])
     except Exception as e:
         logger.warning(f"Forgive users error: {e}", exc_info=True)
 
@@ -575,7 +577,7 @@ def get_uid_from_text(message: Message) -> int:
     return result
 
 
-@threaded()
+@threaded(pool="slow")
 def kick_user(client: Client, gid: int, uid: Union[int, str], until_date: int = 0, lock: bool = False) -> bool:
     # Kick a user
     result = False
@@ -599,7 +601,7 @@ def kick_user(client: Client, gid: int, uid: Union[int, str], until_date: int =
     return result
 
 
-@threaded()
+@threaded(pool="slow")
 def kick_users(client: Client, gid: int, uids: Iterable[int]) -> bool:
     # Kick users
     result = False
@@ -636,6 +638,7 @@ def lift_ban(client: Client, uid: int, now: int) -> bool:
                 continue
 
             glovar.user_ids[uid]["failed"][gid] = 0
+            save("user_ids", uid)
             unban_user(client, gid, uid, lock=True)
 
         result = True
@@ -645,7 +648,7 @@ def lift_ban(client: Client, uid: int, now: int) -> bool:
     return result
 
 
-@threaded()
+@threaded(pool="disk")
 def qns_count(gid: int, key: str, the_type: str) -> bool:
     # Qns count
     result = False
@@ -671,7 +674,7 @@ def qns_count(gid: int, key: str, the_type: str) -> bool:
         if the_type == "succeed":
             glovar.questions[gid]["qns"][key]["solved"] += 1
 
-        save("questions")
+        save("questions", gid)
 
         result = True
     except Exception as e:
@@ -701,7 +704,8 @@ def remove_captcha_group(client: Client, uid: int) -> bool:
             return False
 
         glovar.user_ids[uid]["time"] = 0
-        save("user_ids")
+        glovar.user_ids[uid].compact()
+        save("user_ids", uid)
         kick_user(client, glovar.captcha_group_id, uid)
 
         result = True
@@ -713,7 +717,7 @@ def remove_captcha_group(client: Client, uid: int) -> bool:
     return result
 
 
-@threaded()
+@threaded(pool="disk")
 def remove_failed_user(uid: int) -> bool:
     # Remove failed user
     result = False
@@ -743,6 +747,8 @@ def remove_group_user(client: Client, uid: int, now: int) -> bool:
             return False
 
         glovar.user_ids[uid]["time"] = 0
+        glovar.user_ids[uid].compact()
+        save("user_ids", uid)
         result = kick_user(client, glovar.captcha_group_id, uid)
     except Exception as e:
         logger.warning(f"Remove group user error: {e}", exc_info=True)
@@ -755,7 +761,7 @@ def remove_new_users() -> bool:
     result = False
 
     try:
-        for uid in list(glovar.user_ids):
+        for uid in get_all_uids(glovar.user_ids):
             glovar.user_ids[uid]["join"] = {}
 
         result = True
@@ -765,7 +771,7 @@ def remove_new_users() -> bool:
     return result
 
 
-@threaded()
+@threaded(pool="slow")
 def remove_wait_user(client: Client, uid: int) -> bool:
     # Remove the user from wait list
     result = False
@@ -796,7 +802,7 @@ def remove_wait_user(client: Client, uid: int) -> bool:
 
         # Delete hint
         not all(is_flooded(gid) for gid in wait_group_list) and delete_hint(client)
-        save("user_ids")
+        save("user_ids", uid)
 
         # Check the groups
         if glovar.user_ids[uid]["wait"]:
@@ -806,7 +812,7 @@ def remove_wait_user(client: Client, uid: int) -> bool:
         glovar.user_ids[uid]["answer"] = ""
         glovar.user_ids[uid]["limit"] = 0
         glovar.user_ids[uid]["try"] = 0
-        save("user_ids")
+        save("user_ids", uid)
 
         # Collect data
         name = glovar.user_ids[uid]["name"]
@@ -814,10 +820,10 @@ def remove_wait_user(client: Client, uid: int) -> bool:
 
         # Reset message id
         glovar.user_ids[uid]["mid"] = 0
-        save("user_ids")
+        save("user_ids", uid)
 
         # Remove from CAPTCHA group
-        delay(10, remove_captcha_group, [client, uid])
+        delay(10, remove_captcha_group, [client, uid], ("remove_captcha_group", uid))
 
         if not mid:
             return True
@@ -832,11 +838,11 @@ def remove_wait_user(client: Client, uid: int) -> bool:
 
         if question_type in glovar.question_types["image"]:
             thread(
-                target=edit_message_photo,
+                target=edit_cached_photo,
                 args=(client, glovar.captcha_group_id, mid, "assets/fail.png", text)
             )
         elif question_type in glovar.question_types["text"]:
-            thread(
+            dispatch(
                 target=edit_message_text,
                 args=(client, glovar.captcha_group_id, mid, text)
             )
@@ -850,7 +856,7 @@ def remove_wait_user(client: Client, uid: int) -> bool:
     return result
 
 
-@threaded()
+@threaded(priority=priority_high)
 def restrict_user(client: Client, gid: int, uid: Union[int, str], until_date: int = 0) -> bool:
     # Restrict a user
     result = False
@@ -884,7 +890,7 @@ def terminate_user_banned(client: Client, uid: int, gid: int) -> bool:
             glovar.user_ids[uid]["succeeded"][gid] = 0
 
         # Save the data
-        save("user_ids")
+        save("user_ids", uid)
 
         # Collect data
         name = glovar.user_ids[uid]["name"]
@@ -892,7 +898,7 @@ def terminate_user_banned(client: Client, uid: int, gid: int) -> bool:
 
         # Check if the group is the only waiting group
         if glovar.user_ids[uid]["wait"] or not glovar.user_ids[uid]["mid"]:
-            return save("user_ids")
+            return save("user_ids", uid)
 
         # Get the captcha status text
         text = (f"{lang('user_name')}{lang('colon')}{mention_text(name, uid)}\n"
@@ -904,21 +910,21 @@ def terminate_user_banned(client: Client, uid: int, gid: int) -> bool:
 
         if question_type in glovar.question_types["image"]:
             thread(
-                target=edit_message_photo,
+                target=edit_cached_photo,
                 args=(client, glovar.captcha_group_id, mid, "assets/fail.png", text)
             )
         elif question_type in glovar.question_types["text"]:
-            thread(
+            dispatch(
                 target=edit_message_text,
                 args=(client, glovar.captcha_group_id, mid, text)
             )
 
         # Reset message id
         glovar.user_ids[uid]["mid"] = 0
-        save("user_ids")
+        save("user_ids", uid)
 
         # Remove from CAPTCHA group
-        delay(10, remove_captcha_group, [client, uid])
+        delay(10, remove_captcha_group, [client, uid], ("remove_captcha_group", uid))
 
         result = failed_user(client, uid, "banned")
     except Exception as e:
@@ -973,7 +979,7 @@ def terminate_user_pass(client: Client, uid: int, gid: int, aid: int) -> bool:
             waiting and ask_help_welcome(client, uid, [gid])
         else:
             glovar.user_ids[uid]["manual"].discard(gid)
-            save("user_ids")
+            save("user_ids", uid)
 
         # Update the score
         update_score(client, uid)
@@ -992,7 +998,7 @@ def terminate_user_pass(client: Client, uid: int, gid: int, aid: int) -> bool:
         failed_user(client, uid, "remove")
 
         # Save the data
-        save("user_ids")
+        save("user_ids", uid)
 
         # Collect data
         name = glovar.user_ids[uid]["name"]
@@ -1012,21 +1018,21 @@ def terminate_user_pass(client: Client, uid: int, gid: int, aid: int) -> bool:
 
         if question_type in glovar.question_types["image"]:
             thread(
-                target=edit_message_photo,
+                target=edit_cached_photo,
                 args=(client, glovar.captcha_group_id, mid, "assets/succeed.png", text)
             )
         elif question_type in glovar.question_types["text"]:
-            thread(
+            dispatch(
                 target=edit_message_text,
                 args=(client, glovar.captcha_group_id, mid, text)
             )
 
         # Reset message id
         glovar.user_ids[uid]["mid"] = 0
-        save("user_ids")
+        save("user_ids", uid)
 
         # Remove from CAPTCHA group
-        delay(10, remove_captcha_group, [client, uid])
+        delay(10, remove_captcha_group, [client, uid], ("remove_captcha_group", uid))
 
         result = True
     except Exception as e:
@@ -1115,12 +1121,12 @@ def terminate_user_succeed(client: Client, uid: int) -> bool:
         not all(is_flooded(gid) for gid in wait_group_list) and delete_hint(client)
 
         # Remove from CAPTCHA group
-        delay(60, remove_captcha_group, [client, uid])
+        delay(60, remove_captcha_group, [client, uid], ("remove_captcha_group", uid))
 
         # Ask help welcome
         welcome_ids = [wid for wid in wait_group_list if wid not in glovar.user_ids[uid]["manual"]]
         glovar.user_ids[uid]["manual"] -= set(wait_group_list)
-        save("user_ids")
+        save("user_ids", uid)
         ask_help_welcome(client, uid, welcome_ids)
 
         # Update the score
@@ -1144,7 +1150,7 @@ def terminate_user_succeed(client: Client, uid: int) -> bool:
 
         # Reset message id
         glovar.user_ids[uid]["mid"] = 0
-        save("user_ids")
+        save("user_ids", uid)
 
         if not mid:
             return True
@@ -1174,11 +1180,11 @@ def terminate_user_succeed(client: Client, uid: int) -> bool:
 
         if question_type in glovar.question_types["image"]:
             thread(
-                target=edit_message_photo,
+                target=edit_cached_photo,
                 args=(client, glovar.captcha_group_id, mid, "assets/succeed.png", text, markup)
             )
         elif question_type in glovar.question_types["text"]:
-            thread(
+            dispatch(
                 target=edit_message_text,
                 args=(client, glovar.captcha_group_id, mid, text, markup)
             )
@@ -1207,7 +1213,7 @@ def terminate_user_succeed_qns(client: Client, gid: int, uid: int, qid: str) ->
         glovar.user_ids[uid]["failed"].pop(gid, 0)
         glovar.user_ids[uid]["restricted"].discard(gid)
         glovar.user_ids[uid]["banned"].discard(gid)
-        save("user_ids")
+        save("user_ids", uid)
 
         # Delete the hint
         not is_flooded(gid) and delete_hint(client)
@@ -1215,7 +1221,7 @@ def terminate_user_succeed_qns(client: Client, gid: int, uid: int, qid: str) ->
         # Ask help welcome
         gid not in glovar.user_ids[uid]["manual"] and ask_help_welcome(client, uid, [gid])
         glovar.user_ids[uid]["manual"].discard(gid)
-        save("user_ids")
+        save("user_ids", uid)
 
         # Send debug message
         send_debug(
@@ -1228,7 +1234,7 @@ def terminate_user_succeed_qns(client: Client, gid: int, uid: int, qid: str) ->
 
         # Answer the callback
         answer_text = glovar.custom_texts[gid].get("correct") or lang("action_verified")
-        thread(answer_callback, (client, qid, answer_text, True))
+        dispatch(answer_callback, (client, qid, answer_text, True))
 
         # Count
         qns_count(gid, key, "succeed")
@@ -1279,6 +1285,7 @@ def terminate_user_timeout(client: Client, uid: int) -> bool:
                 glovar.user_ids[uid]["failed"][gid] = 0
             else:
                 glovar.user_ids[uid]["failed"][gid] = now
+                add_deadline(uid)
 
             # Flood log
             is_flooded(gid) and flood_user(gid, uid, now, level, "timeout")
@@ -1299,10 +1306,10 @@ def terminate_user_timeout(client: Client, uid: int) -> bool:
 
         # Reset message id
         glovar.user_ids[uid]["mid"] = 0
-        save("user_ids")
+        save("user_ids", uid)
 
         # Remove from CAPTCHA group
-        delay(10, remove_captcha_group, [client, uid])
+        delay(10, remove_captcha_group, [client, uid], ("remove_captcha_group", uid))
 
         # Update the score
         not any(is_flooded(gid) for gid in wait_group_list) and update_score(client, uid)
@@ -1323,11 +1330,11 @@ def terminate_user_timeout(client: Client, uid: int) -> bool:
 
         if question_type in glovar.question_types["image"]:
             thread(
-                target=edit_message_photo,
+                target=edit_cached_photo,
                 args=(client, glovar.captcha_group_id, mid, "assets/fail.png", text)
             )
         elif question_type in glovar.question_types["text"]:
-            thread(
+            dispatch(
                 target=edit_message_text,
                 args=(client, glovar.captcha_group_id, mid, text)
             )
@@ -1353,7 +1360,7 @@ def terminate_user_timeout_qns(client: Client, gid: int, uid: int) -> bool:
         glovar.user_ids[uid]["manual"].discard(gid)
         glovar.user_ids[uid]["restricted"].discard(gid)
         glovar.user_ids[uid]["banned"].discard(gid)
-        save("user_ids")
+        save("user_ids", uid)
 
         # Count the failure
         if glovar.user_ids[uid]["failed"].get(gid) is None or glovar.user_ids[uid]["failed"][gid] > 0:
@@ -1377,6 +1384,7 @@ def terminate_user_timeout_qns(client: Client, gid: int, uid: int) -> bool:
             glovar.user_ids[uid]["failed"][gid] = 0
         else:
             glovar.user_ids[uid]["failed"][gid] = now
+            add_deadline(uid)
 
         # Delete all messages from the user
         not is_flooded(gid) and ask_for_help(client, "delete", gid, uid)
@@ -1411,7 +1419,7 @@ def terminate_user_undo_pass(client: Client, uid: int, gid: int, aid: int) -> bo
 
         # Reset status
         glovar.user_ids[uid]["pass"].pop(gid, 0)
-        save("user_ids")
+        save("user_ids", uid)
 
         # Update the score
         not is_flooded(gid) and update_score(client, uid)
@@ -1459,6 +1467,7 @@ def terminate_user_wrong(client: Client, uid: int) -> bool:
 
             # Give the user one more chance
             glovar.user_ids[uid]["failed"][gid] = now
+            add_deadline(uid)
             glovar.user_ids[uid]["restricted"].discard(gid)
             glovar.user_ids[uid]["banned"].discard(gid)
 
@@ -1471,13 +1480,13 @@ def terminate_user_wrong(client: Client, uid: int) -> bool:
 
         # Reset message id
         glovar.user_ids[uid]["mid"] = 0
-        save("user_ids")
+        save("user_ids", uid)
 
         # Delete the hint
         not all(is_flooded(gid) for gid in wait_group_list) and delete_hint(client)
 
         # Remove from CAPTCHA group
-        delay(15, remove_captcha_group, [client, uid])
+        delay(15, remove_captcha_group, [client, uid], ("remove_captcha_group", uid))
 
         # Update the score
         not any(is_flooded(gid) for gid in wait_group_list) and update_score(client, uid)
@@ -1510,11 +1519,11 @@ def terminate_user_wrong(client: Client, uid: int) -> bool:
 
         if question_type in glovar.question_types["image"]:
             thread(
-                target=edit_message_photo,
+                target=edit_cached_photo,
                 args=(client, glovar.captcha_group_id, mid, "assets/fail.png", text)
             )
         elif question_type in glovar.question_types["text"]:
-            thread(
+            dispatch(
                 target=edit_message_text,
                 args=(client, glovar.captcha_group_id, mid, text)
             )
@@ -1541,7 +1550,7 @@ def terminate_user_wrong_qns(client: Client, gid: int, uid: int, qid: str) -> bo
         glovar.user_ids[uid]["manual"].discard(gid)
         glovar.user_ids[uid]["restricted"].discard(gid)
         glovar.user_ids[uid]["banned"].discard(gid)
-        save("user_ids")
+        save("user_ids", uid)
 
         # Count the failure
         if glovar.user_ids[uid]["failed"].get(gid) is None or glovar.user_ids[uid]["failed"][gid] > 0:
@@ -1571,6 +1580,7 @@ def terminate_user_wrong_qns(client: Client, gid: int, uid: int, qid: str) -> bo
             glovar.user_ids[uid]["failed"][gid] = 0
         else:
             glovar.user_ids[uid]["failed"][gid] = now
+            add_deadline(uid)
 
         # Delete all messages from the user
         not is_flooded(gid) and ask_for_help(client, "delete", gid, uid)
@@ -1592,7 +1602,7 @@ def terminate_user_wrong_qns(client: Client, gid: int, uid: int, qid: str) -> bo
         )
 
         # Answer the callback
-        thread(answer_callback, (client, qid, callback_text, True))
+        dispatch(answer_callback, (client, qid, callback_text, True))
 
         # Count
         qns_count(gid, key, "wrong")
@@ -1604,7 +1614,7 @@ def terminate_user_wrong_qns(client: Client, gid: int, uid: int, qid: str) -> bo
     return result
 
 
-@threaded()
+@threaded(priority=priority_high)
 def unban_user(client: Client, gid: int, uid: int, lock: bool = False) -> bool:
     # Unban a user
     result = False
@@ -1621,7 +1631,7 @@ def unban_user(client: Client, gid: int, uid: int, lock: bool = False) -> bool:
     return result
 
 
-@threaded()
+@threaded(priority=priority_high)
 def unrestrict_user(client: Client, gid: int, uid: Union[int, str], lock: bool = False) -> bool:
     # Unrestrict a user
     result = False
@@ -18,21 +18,28 @@
 
 import logging
 import pickle
+import sqlite3
 from codecs import getdecoder
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from configparser import RawConfigParser
-from glob import glob
-from os import mkdir
+from os import fsync, mkdir, stat
 from os.path import exists
 from shutil import rmtree
 from string import ascii_lowercase
-from threading import Lock
-from typing import Dict, List, Set, Union
+from threading import Condition, Lock, RLock
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Pattern, Set, Tuple, Union
 
 from emoji import UNICODE_EMOJI
 from pyrogram.types import Chat
 from yaml import safe_load
 
 from .checker import check_all
+from .emojis import get_emoji_trie
+from .pics import get_pic_index
+from .special import get_special_dict, get_special_table
+from .status import UserStatus, UserTable, get_user_records, rebuild_wait_index
+from .workers import WorkerPool, get_pools
 
 # Enable logging
 logging.basicConfig(
@@ -73,6 +80,9 @@ font_chinese: str = "/usr/share/fonts/truetype/arphic-gkai00mp/gkai00mp.ttf"
 font_english: str = "/usr/share/fonts/truetype/freefont/FreeMono.ttf"
 font_number: str = "/usr/share/fonts/truetype/freefont/FreeMono.ttf"
 noise: float = 0.4
+pool_high: int = 20
+pool_low: int = 5
+processes: int = 0
 
 # [channels]
 captcha_group_id: int = 0
@@ -108,21 +118,33 @@ key: Union[bytes, str] = ""
 password: str = ""
 
 # [language]
+cjk_only: Union[bool, str] = "False"
 lang: str = "cmn-Hans"
 normalize: Union[bool, str] = "True"
 
 # [limit]
+limit_chat: int = 20
+limit_convert: int = 10000
 limit_flood: int = 10
+limit_journal: int = 10000
+limit_latency: int = 1000
 limit_mention: int = 20
+limit_name: int = 4096
+limit_render: int = 4
+limit_send: int = 30
 limit_track: int = 8
 limit_try: int = 2
+limit_waiting: int = 50
 
 # [mode]
 aio: Union[bool, str] = "False"
+async_calls: Union[bool, str] = "False"
 backup: Union[bool, str] = "False"
+debug: Union[bool, str] = "False"
 failed: Union[bool, str] = "False"
 simple: Union[bool, str] = "False"
 simple_only: Union[bool, str] = "False"
+storage: str = "pickle"
 
 # [time]
 date_reset: str = "1st mon"
@@ -132,9 +154,19 @@ time_new: int = 1800
 time_punish: int = 600
 time_recheck: int = 3600
 time_remove: int = 300
+time_save: int = 5
 time_short: int = 300
 time_track: int = 3600
 
+# [worker]
+worker_disk: int = 1
+worker_exchange: int = 2
+worker_overflow: int = 32
+worker_queue: int = 1000
+worker_read: int = 4
+worker_slow: int = 8
+worker_write: int = 8
+
 try:
     config = RawConfigParser()
     config.read("config.ini")
@@ -164,6 +196,9 @@ try:
     font_english = config.get("captcha", "font_english", fallback=font_english)
     font_number = config.get("captcha", "font_english", fallback=font_number)
     noise = float(config.get("captcha", "noise", fallback=noise))
+    pool_high = int(config.get("captcha", "pool_high", fallback=pool_high))
+    pool_low = int(config.get("captcha", "pool_low", fallback=pool_low))
+    processes = int(config.get("captcha", "processes", fallback=processes))
 
     # [channels]
     captcha_group_id = int(config.get("channels", "captcha_group_id", fallback=captcha_group_id))
@@ -202,27 +237,42 @@ try:
     password = config.get("encrypt", "password", fallback=password)
 
     # [language]
+    cjk_only = config.get("language", "cjk_only", fallback=cjk_only)
+    cjk_only = eval(cjk_only)
     lang = config.get("language", "lang", fallback=lang)
     normalize = config.get("language", "normalize", fallback=normalize)
     normalize = eval(normalize)
 
     # [limit]
+    limit_chat = int(config.get("limit", "limit_chat", fallback=limit_chat))
+    limit_convert = int(config.get("limit", "limit_convert", fallback=limit_convert))
     limit_flood = int(config.get("limit", "limit_flood", fallback=limit_flood))
+    limit_journal = int(config.get("limit", "limit_journal", fallback=limit_journal))
+    limit_latency = int(config.get("limit", "limit_latency", fallback=limit_latency))
     limit_mention = int(config.get("limit", "limit_mention", fallback=limit_mention))
+    limit_name = int(config.get("limit", "limit_name", fallback=limit_name))
+    limit_render = int(config.get("limit", "limit_render", fallback=limit_render))
+    limit_send = int(config.get("limit", "limit_send", fallback=limit_send))
     limit_track = int(config.get("limit", "limit_track", fallback=limit_track))
     limit_try = int(config.get("limit", "limit_try", fallback=limit_try))
+    limit_waiting = int(config.get("limit", "limit_waiting", fallback=limit_waiting))
 
     # [mode]
     aio = config.get("mode", "aio", fallback=aio)
     aio = eval(aio)
+    async_calls = config.get("mode", "async_calls", fallback=async_calls)
+    async_calls = eval(async_calls)
     backup = config.get("mode", "backup", fallback=backup)
     backup = eval(backup)
+    debug = config.get("mode", "debug", fallback=debug)
+    debug = eval(debug)
     failed = config.get("mode", "failed", fallback=failed)
     failed = eval(failed)
     simple = config.get("mode", "simple", fallback=simple)
     simple = eval(simple)
     simple_only = config.get("mode", "simple_only", fallback=simple_only)
     simple_only = eval(simple_only)
+    storage = config.get("mode", "storage", fallback=storage)
 
     # [time]
     date_reset = config.get("time", "date_reset", fallback=date_reset)
@@ -232,9 +282,19 @@ try:
     time_punish = int(config.get("time", "time_punish", fallback=time_punish))
     time_recheck = int(config.get("time", "time_recheck", fallback=time_recheck))
     time_remove = int(config.get("time", "time_remove", fallback=time_remove))
+    time_save = int(config.get("time", "time_save", fallback=time_save))
     time_short = int(config.get("time", "time_short", fallback=time_short))
     time_track = int(config.get("time", "time_track", fallback=time_track))
 
+    # [worker]
+    worker_disk = int(config.get("worker", "worker_disk", fallback=worker_disk))
+    worker_exchange = int(config.get("worker", "worker_exchange", fallback=worker_exchange))
+    worker_overflow = int(config.get("worker", "worker_overflow", fallback=worker_overflow))
+    worker_queue = int(config.get("worker", "worker_queue", fallback=worker_queue))
+    worker_read = int(config.get("worker", "worker_read", fallback=worker_read))
+    worker_slow = int(config.get("worker", "worker_slow", fallback=worker_slow))
+    worker_write = int(config.get("worker", "worker_write", fallback=worker_write))
+
     # [flag]
     broken = False
 except Exception as e:
@@ -264,7 +324,10 @@ check_all(
             "font_chinese": font_chinese,
             "font_english": font_english,
             "font_number": font_number,
-            "noise": noise
+            "noise": noise,
+            "pool_high": pool_high,
+            "pool_low": pool_low,
+            "processes": processes
         },
         "channels": {
             "captcha_group_id": captcha_group_id,
@@ -299,21 +362,33 @@ check_all(
             "password": password
         },
         "language": {
+            "cjk_only": cjk_only,
             "lang": lang,
             "normalize": normalize
         },
         "limit": {
+            "limit_chat": limit_chat,
+            "limit_convert": limit_convert,
             "limit_flood": limit_flood,
+            "limit_journal": limit_journal,
+            "limit_latency": limit_latency,
             "limit_mention": limit_mention,
+            "limit_name": limit_name,
+            "limit_render": limit_render,
+            "limit_send": limit_send,
             "limit_track": limit_track,
-            "limit_try": limit_try
+            "limit_try": limit_try,
+            "limit_waiting": limit_waiting
         },
         "mode": {
             "aio": aio,
+            "async_calls": async_calls,
             "backup": backup,
+            "debug": debug,
             "failed": failed,
             "simple": simple,
-            "simple_only": simple_only
+            "simple_only": simple_only,
+            "storage": storage
         },
         "time": {
             "date_reset": date_reset,
@@ -323,8 +398,18 @@ check_all(
             "time_punish": time_punish,
             "time_recheck": time_recheck,
             "time_remove": time_remove,
+            "time_save": time_save,
             "time_short": time_short,
             "time_track": time_track
+        },
+        "worker": {
+            "worker_disk": worker_disk,
+            "worker_exchange": worker_exchange,
+            "worker_overflow": worker_overflow,
+            "worker_queue": worker_queue,
+            "worker_read": worker_read,
+            "worker_slow": worker_slow,
+            "worker_write": worker_write
         }
     },
     broken
@@ -423,47 +508,88 @@ default_question_data: Dict[str, Union[int, str, Dict[str, Dict[str, Union[int,
     "qns": {}
 }
 
-default_user_status: Dict[str, Union[int, str, Dict[Union[int, str], Union[float, int, str]], Set[int]]] = {
-    "name": "",
-    "mid": 0,
-    "time": 0,
-    "answer": "",
-    "limit": 0,
-    "try": 0,
-    "join": {},
-    "pass": {},
-    "wait": {},
-    "qns": {},
-    "succeeded": {},
-    "failed": {},
-    "restricted": set(),
-    "banned": set(),
-    "manual": set(),
-    "score": {
-        "captcha": 0.0,
-        "clean": 0.0,
-        "lang": 0.0,
-        "long": 0.0,
-        "noflood": 0.0,
-        "noporn": 0.0,
-        "nospam": 0.0,
-        "warn": 0.0
-    }
-}
+# Token buckets of the Bot API calls, the key of the global bucket is 0
+bucket_condition: Condition = Condition()
+
+buckets: Dict[int, List[float]] = {}
+# buckets = {
+#     0: [30.0, 123456.78, 0.0],
+#     -10012345678: [tokens, refilled_at, blocked_until]
+# }
+
+# The calls waiting for the global bucket of each priority
+bucket_waiting: List[int] = [0, 0, 0]
+
+deadline_condition: Condition = Condition()
+
+deadline_ids: Dict[int, int] = {}
+# deadline_ids = {
+#     12345678: 1512345678
+# }
+
+deadlines: List[Tuple[int, int]] = []
+# deadlines = [(1512345678, 12345678)]
 
-emoji_set: Set[str] = set(UNICODE_EMOJI)
+delay_condition: Condition = Condition()
 
+delay_count: int = 0
+
+delay_tasks: Dict[Hashable, Tuple[int, Callable, list, str]] = {}
+# delay_tasks = {
+#     ("remove_captcha_group", 12345678): (1, remove_captcha_group, [client, 12345678], "write")
+# }
+
+delays: List[Tuple[float, int, Hashable]] = []
+# delays = [(123456.78, 1, ("remove_captcha_group", 12345678))]
+
+# The messages to delete of each group, deleted together in a short while
+delete_ids: Dict[int, List[int]] = {}
+# delete_ids = {
+#     -10012345678: [123, 124]
+# }
+
+# Newer versions of emoji group the data by language
+emoji_set: Set[str] = set(UNICODE_EMOJI.get("en", UNICODE_EMOJI))
+
+emoji_trie: dict = get_emoji_trie(emoji_set, emoji_protect)
+
+file_hashes: Dict[str, Tuple[int, int, str]] = {}
+# file_hashes = {
+#     "assets/fail.png": (1024, 1512345678000000000, "sha256")
+# }
+
+journal_counts: Dict[str, int] = {}
+# journal_counts = {
+#     "user_ids": 0
+# }
+
+journal_files: Set[str] = {"user_ids"}
+
+if storage == "journal":
+    keyed_files = journal_files
+elif storage == "sqlite":
+    keyed_files = {"configs", "message_ids", "pinned_ids", "questions", "user_ids"}
+else:
+    keyed_files = set()
+
+# The flush lock guards every use of the sqlite connection, it is reentrant because the user table
+# reads the records that are not in memory during a flush
 locks: Dict[str, Lock] = {
     "admin": Lock(),
     "ban": Lock(),
     "config": Lock(),
+    "count": Lock(),
+    "delete": Lock(),
     "failed": Lock(),
     "flood": Lock(),
+    "flush": RLock(),
     "invite": Lock(),
     "message": Lock(),
     "pin": Lock(),
     "receive": Lock(),
-    "regex": Lock()
+    "regex": Lock(),
+    "render": Lock(),
+    "save": Lock()
 }
 
 pass_counts: Dict[int, int] = {}
@@ -521,6 +647,40 @@ regex: Dict[str, bool] = {
 for c in ascii_lowercase:
     regex[f"ad{c}"] = False
 
+regex_counts: Dict[str, Dict[str, int]] = {}
+# regex_counts = {
+#     "ad": {
+#         "regex": 0
+#     }
+# }
+
+regex_generation: int = 0
+
+regex_patterns: Dict[str, List[Tuple[str, Pattern, bool]]] = {}
+# regex_patterns = {
+#     "ad": [("regex", re.compile("regex"), False)]
+# }
+
+save_counts: Dict[str, Union[float, int]] = {
+    "request": 0,
+    "merge": 0,
+    "flush": 0,
+    "file": 0,
+    "record": 0,
+    "time": 0.0,
+    "max": 0.0
+}
+
+save_dirty: Set[str] = set()
+# save_dirty = {"user_ids"}
+
+save_keys: Dict[str, Set[int]] = {}
+# save_keys = {
+#     "user_ids": {12345678}
+# }
+
+save_started: bool = False
+
 sender: str = "CAPTCHA"
 
 should_hide: bool = False
@@ -540,26 +700,23 @@ version: str = "0.6.8"
 
 # Load data from pics database
 
-pics: Dict[str, List[str]] = {}
+pic_index: Dict[str, Dict[str, Tuple[int, int, int]]] = get_pic_index()
 
-if exists("assets/pics"):
-    dir_list = glob("assets/pics/*")
-else:
-    dir_list = []
-
-for dir_path in dir_list:
-    dir_name = dir_path.split("/")[-1]
-
-    if not 0 < len(dir_name.encode()) <= 64:
-        continue
+pics: Dict[str, Tuple[str, ...]] = {name: tuple(files) for name, files in pic_index.items()}
+# pics = {
+#     "cat": ("assets/pics/cat/1.jpg",)
+# }
 
-    pics[dir_name] = []
-    file_list = glob(f"{dir_path}/*")
+pic_names: Tuple[str, ...] = tuple(pics)
 
-    for file in file_list:
-        pics[dir_name].append(file)
+pic_sizes: Dict[str, Tuple[int, int, int]] = {path: size for files in pic_index.values()
+                                              for path, size in files.items()}
+# pic_sizes = {
+#     "assets/pics/cat/1.jpg": (300, 200, 1024)
+# }
 
-if pics and not simple_only:
+# Three categories are needed for the candidates
+if len(pics) >= 3 and not simple_only:
     append_types = ["chinese", "english"]
 else:
     append_types = []
@@ -582,6 +739,43 @@ for word_type in ["chengyu", "food"]:
         words = [word for word in candidates if 0 < len(word.encode()) <= 64]
         chinese_words[word_type] = words
 
+# Pre-rendered captchas of the image question types
+if "Hans" in lang:
+    pool_types = question_types["chinese"]
+else:
+    pool_types = question_types["english"]
+
+captcha_condition: Condition = Condition()
+
+render_types: Set[str] = {"chengyu", "food", "letter", "math_pic", "number"}
+
+captcha_pool: Dict[str, Deque[dict]] = {question_type: deque() for question_type in pool_types
+                                        if pool_high and question_type in render_types}
+# captcha_pool = {
+#     "letter": deque([{"image": ImageBuffer(), "question": "question", "answer": "answer", "limit": 2}])
+# }
+
+# Rendering processes, started by main.py
+render_executor: Optional[ProcessPoolExecutor] = None
+
+# Worker pools, the slow pool takes the jobs that sleep or hold a shared lock
+pools: Dict[str, WorkerPool] = get_pools(
+    sizes={
+        "disk": worker_disk,
+        "exchange": worker_exchange,
+        "read": worker_read,
+        "slow": worker_slow,
+        "write": worker_write
+    },
+    queue=worker_queue,
+    overflow=worker_overflow
+)
+
+# The load of the join path, used to choose the question tier
+question_tier: int = 0
+render_latency: float = 0.0
+render_pending: int = 0
+
 if exists("start.txt"):
     with open("start.txt", "r", encoding="utf-8") as f:
         start_text = f.read()
@@ -674,7 +868,7 @@ trust_ids: Dict[int, Set[int]] = {}
 #     -10012345678: {12345678}
 # }
 
-user_ids: Dict[int, Dict[str, Union[int, str, Dict[Union[int, str], Union[float, int, str]], Set[int]]]] = {}
+user_ids: Dict[int, UserStatus] = {}
 # user_ids = {
 #     12345678: {
 #         "name": "name",
@@ -765,6 +959,11 @@ custom_texts: Dict[int, Dict[str, str]] = {}
 #     }
 # }
 
+file_ids: Dict[str, str] = {}
+# file_ids = {
+#     "sha256": "file_id"
+# }
+
 flood_logs: Dict[int, List[Dict[str, Union[int, str]]]] = {}
 # flood_logs = {
 #     -10012345678: [
@@ -830,15 +1029,69 @@ for word_type in regex:
 #     "regex": 0
 # }
 
+# Load data from the database
+sqlite_columns: Dict[str, List[str]] = {
+    "configs": [],
+    "message_ids": [],
+    "pinned_ids": [],
+    "questions": [],
+    "user_ids": ["wait", "failed", "time"]
+}
+
+sqlite_connection: Optional[sqlite3.Connection] = None
+
+# The tables that have data, their pickle files are not loaded
+sqlite_loaded: Set[str] = set()
+
+if storage == "sqlite":
+    table_list = sqlite_columns
+else:
+    table_list = {}
+
+try:
+    if table_list:
+        sqlite_connection = sqlite3.connect("data/data.db", check_same_thread=False)
+        sqlite_connection.execute("PRAGMA journal_mode=WAL")
+        sqlite_connection.execute("PRAGMA synchronous=NORMAL")
+
+    for file in table_list:
+        table_columns = "".join(f"{column} INTEGER NOT NULL DEFAULT 0, " for column in sqlite_columns[file])
+        sqlite_connection.execute(f"CREATE TABLE IF NOT EXISTS {file} "
+                                  f"(id INTEGER PRIMARY KEY, {table_columns}data BLOB NOT NULL)")
+
+        for column in sqlite_columns[file]:
+            sqlite_connection.execute(f"CREATE INDEX IF NOT EXISTS {file}_{column} ON {file} ({column})")
+
+        sqlite_connection.commit()
+
+        if not sqlite_connection.execute(f"SELECT 1 FROM {file} LIMIT 1").fetchone():
+            continue
+
+        # Only the live users are loaded, the others are read when they are used
+        if file == "user_ids":
+            table_rows = sqlite_connection.execute("SELECT id, data FROM user_ids "
+                                                   "WHERE wait > 0 OR failed > 0 OR time > 0").fetchall()
+        else:
+            table_rows = sqlite_connection.execute(f"SELECT id, data FROM {file}").fetchall()
+
+        locals()[f"{file}"] = {row_id: pickle.loads(row_data) for row_id, row_data in table_rows}
+        sqlite_loaded.add(file)
+except Exception as e:
+    logger.critical(f"Load data from the database error: {e}", exc_info=True)
+    raise SystemExit("[DATA CORRUPTION]")
+
 # Load data
 file_list: List[str] = ["admin_ids", "bad_ids", "failed_ids", "flooded_ids", "ignore_ids", "lack_group_ids",
                         "left_group_ids", "message_ids", "pinned_ids", "trust_ids", "user_ids", "watch_ids",
                         "white_ids",
-                        "configs", "custom_texts", "flood_logs", "invite", "questions", "reset_time", "starts",
-                        "token"]
+                        "configs", "custom_texts", "file_ids", "flood_logs", "invite", "questions", "reset_time",
+                        "starts", "token"]
 file_list += [f"{f}_words" for f in regex]
 
 for file in file_list:
+    if file in sqlite_loaded:
+        continue
+
     try:
         try:
             if exists(f"data/{file}") or exists(f"data/.{file}"):
@@ -856,24 +1109,74 @@ for file in file_list:
         logger.critical(f"Load data {file} backup error: {e}", exc_info=True)
         raise SystemExit("[DATA CORRUPTION]")
 
-# Generate special characters dictionary
-for special in ["spc", "spe"]:
-    locals()[f"{special}_dict"]: Dict[str, str] = {}
+# Replay the journals
+if storage == "journal":
+    journal_list = journal_files
+else:
+    journal_list = set()
 
-    for rule in locals()[f"{special}_words"]:
-        # Check keys
-        if "[" not in rule:
-            continue
+for file in journal_list:
+    journal_counts[file] = 0
 
-        # Check value
-        if "?#" not in rule:
-            continue
+    if not exists(f"data/{file}.journal"):
+        continue
+
+    try:
+        journal_end = 0
+
+        with open(f"data/{file}.journal", "rb") as f:
+            journal_header = pickle.load(f)
+            journal_snapshot = stat(f"data/{file}")
+
+            if journal_header != ("snapshot", journal_snapshot.st_size, journal_snapshot.st_mtime_ns):
+                logger.warning(f"Journal {file} does not match the snapshot, ignored")
+                continue
+
+            while True:
+                journal_offset = f.tell()
+
+                try:
+                    journal_key, journal_value = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception as e:
+                    logger.warning(f"Journal {file} is truncated at {journal_offset}: {e}")
+                    journal_end = journal_offset
+                    break
+
+                if journal_value is None:
+                    locals()[f"{file}"].pop(journal_key, None)
+                else:
+                    locals()[f"{file}"][journal_key] = journal_value
+
+                journal_counts[file] += 1
+
+        # Cut the broken tail, so the new records are not appended after it
+        if journal_end:
+            with open(f"data/{file}.journal", "r+b") as f:
+                f.truncate(journal_end)
+                f.flush()
+                fsync(f.fileno())
+    except Exception as e:
+        logger.critical(f"Replay journal {file} error: {e}", exc_info=True)
+        raise SystemExit("[DATA CORRUPTION]")
+
+# Move the pickled data into the empty tables
+for file in table_list:
+    file not in sqlite_loaded and locals()[f"{file}"] and save_dirty.add(file)
+
+# Convert the user records
+user_ids = get_user_records(user_ids)
+
+if storage == "sqlite":
+    user_ids = UserTable(sqlite_connection, locks["flush"], user_ids)
 
-        keys = rule.split("]")[0][1:]
-        value = rule.split("?#")[1][1]
+rebuild_wait_index(user_ids)
 
-        for k in keys:
-            locals()[f"{special}_dict"][k] = value
+# Generate special characters dictionary and the translation table
+spc_dict: Dict[str, str] = get_special_dict(locals()["spc_words"])
+spe_dict: Dict[str, str] = get_special_dict(locals()["spe_words"])
+special_table: Dict[int, str] = get_special_table(spc_dict, spe_dict)
 
 # Start program
 copyright_text = (f"SCP-079-{sender} v{version}, Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>\n"
@@ -24,10 +24,10 @@ from pyrogram.types import CallbackQuery
 
 from .. import glovar
 from ..functions.challenge import get_answer, question_answer, question_answer_qns, question_change
-from ..functions.etc import get_int, get_now, get_text, lang, thread
+from ..functions.etc import get_int, get_now, get_text, lang
 from ..functions.filters import authorized_group, captcha_group, from_user, is_class_e_user, test_group
 from ..functions.group import delete_message
-from ..functions.telegram import answer_callback, edit_message_reply_markup
+from ..functions.telegram import answer_callback, dispatch, edit_message_reply_markup
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -80,7 +80,7 @@ def check_group(client: Client, callback_query: CallbackQuery) -> bool:
             text = lang("check_no")
 
         # Answer the callback
-        thread(answer_callback, (client, callback_query.id, text, True))
+        dispatch(answer_callback, (client, callback_query.id, text, True))
 
         result = True
     except Exception as e:
@@ -110,7 +110,7 @@ def example(client: Client, callback_query: CallbackQuery) -> bool:
             return False
 
         # Edit the message
-        thread(edit_message_reply_markup, (client, cid, mid, None))
+        dispatch(edit_message_reply_markup, (client, cid, mid, None))
     except Exception as e:
         logger.warning(f"Example error: {e}", exc_info=True)
 
@@ -164,7 +164,7 @@ def question(client: Client, callback_query: CallbackQuery) -> bool:
             question_change(client, uid, mid)
 
         # Answer the callback
-        thread(answer_callback, (client, callback_query.id, ""))
+        dispatch(answer_callback, (client, callback_query.id, ""))
 
         result = True
     except Exception as e:
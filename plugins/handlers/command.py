@@ -39,7 +39,8 @@ from ..functions.filters import (authorized_group, captcha_group, class_e, from_
 from ..functions.group import delete_message
 from ..functions.ids import init_user_id
 from ..functions.markup import get_text_and_markup
-from ..functions.telegram import forward_messages, get_group_info, get_start, send_message, send_report_message
+from ..functions.telegram import (dispatch, forward_messages, get_group_info, get_start, send_message,
+                                  send_report_message)
 from ..functions.user import add_start, get_uid, terminate_user_pass, terminate_user_succeed, terminate_user_undo_pass
 
 # Enable logging
@@ -214,7 +215,7 @@ def config(client: Client, message: Message) -> bool:
 
         # Set lock
         glovar.configs[gid]["lock"] = now
-        save("configs")
+        save("configs", gid)
 
         # Ask CONFIG generate a config session
         group_name, group_link = get_group_info(client, message.chat)
@@ -244,7 +245,7 @@ def config(client: Client, message: Message) -> bool:
         if result:
             text += f"{lang('evidence')}{lang('colon')}{general_link(result.message_id, message_link(result))}\n"
 
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        dispatch(send_message, (client, glovar.debug_channel_id, text))
 
         result = True
     except Exception as e:
@@ -526,7 +527,7 @@ def flood(client: Client, message: Message) -> bool:
 
         # Adjust the config
         glovar.configs[gid]["manual"] = True
-        save("configs")
+        save("configs", gid)
 
         # Generate the report text
         description = ("已尝试关闭炸群模式，视 USER 的工作状态，这可能稍有延迟。"
@@ -606,7 +607,7 @@ def pass_captcha(client: Client, message: Message) -> bool:
                 f"{lang('admin')}{lang('colon')}{code(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('action_pass'))}\n"
                 f"{lang('user_id')}{lang('colon')}{code(uid)}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        dispatch(send_message, (client, glovar.debug_channel_id, text))
 
         result = True
     except Exception as e:
@@ -773,7 +774,7 @@ def qns(client: Client, message: Message) -> bool:
         text += (f"{lang('admin_group')}{lang('colon')}{code(message.from_user.id)}\n"
                  f"{lang('action')}{lang('colon')}{code(lang('config_create'))}\n"
                  f"{lang('evidence')}{lang('colon')}{general_link(result.message_id, message_link(result))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        dispatch(send_message, (client, glovar.debug_channel_id, text))
 
         result = True
     except Exception as e:
@@ -930,7 +931,7 @@ def start(client: Client, message: Message) -> bool:
         text, markup = get_text_and_markup(glovar.start_text)
 
         # Send the report message
-        thread(send_message, (client, cid, text, mid, markup))
+        dispatch(send_message, (client, cid, text, mid, markup))
 
         result = True
     except Exception as e:
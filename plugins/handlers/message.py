@@ -25,7 +25,7 @@ from .. import glovar
 from ..functions.challenge import question_answer, question_ask, user_captcha, user_captcha_qns
 from ..functions.channel import ask_help_welcome, get_debug_text
 from ..functions.command import delete_normal_command
-from ..functions.etc import code, general_link, get_now, lang, thread, mention_id
+from ..functions.etc import code, general_link, get_now, lang, mention_id
 from ..functions.file import save
 from ..functions.filters import aio, authorized_group, captcha_group, class_c, class_d, class_e, declared_message
 from ..functions.filters import exchange_channel, from_user, hide_channel, is_class_d_user, is_class_e_user
@@ -39,7 +39,7 @@ from ..functions.receive import receive_warn_kicked_user, receive_ignore_ids, re
 from ..functions.receive import receive_refresh, receive_remove_bad, receive_remove_score, receive_remove_watch
 from ..functions.receive import receive_remove_white, receive_rollback, receive_text_data, receive_user_score
 from ..functions.receive import receive_watch_user, receive_white_users
-from ..functions.telegram import get_admins, send_message
+from ..functions.telegram import dispatch, get_admins, send_message
 from ..functions.timers import backup_files, send_count, share_failed_users
 from ..functions.user import get_level, kick_user, terminate_user_delete
 
@@ -116,7 +116,7 @@ def hint(client: Client, message: Message) -> bool:
 
             # Update user's join status
             glovar.user_ids[uid]["join"][gid] = now
-            save("user_ids")
+            save("user_ids", uid)
 
         result = True
     except Exception as e:
@@ -194,7 +194,7 @@ def hint_further(client: Client, chat_member_updated: ChatMemberUpdated) -> bool
 
         # Update user's join status
         glovar.user_ids[uid]["join"][gid] = now
-        save("user_ids")
+        save("user_ids", uid)
 
         result = True
     except Exception as e:
@@ -399,7 +399,7 @@ def exchange_emergency(client: Client, message: Message) -> bool:
         text = (f"{lang('project')}{lang('colon')}{project_text}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('transfer_channel'))}\n"
                 f"{lang('emergency_channel')}{lang('colon')}{code(hide_text)}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        dispatch(send_message, (client, glovar.debug_channel_id, text))
 
         result = True
     except Exception as e:
@@ -441,7 +441,7 @@ def init_group(client: Client, message: Message) -> bool:
             else:
                 text += f"{lang('inviter')}{lang('colon')}{code(inviter.id)}\n"
 
-            return thread(send_message, (client, glovar.debug_channel_id, text))
+            return dispatch(send_message, (client, glovar.debug_channel_id, text))
 
         # Remove the left status
         if gid in glovar.left_group_ids:
@@ -470,7 +470,7 @@ def init_group(client: Client, message: Message) -> bool:
             text += f"{lang('inviter')}{lang('colon')}{code(inviter.id)}\n"
 
         # Send debug message
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        dispatch(send_message, (client, glovar.debug_channel_id, text))
 
         result = True
     except Exception as e:
@@ -0,0 +1,100 @@
+# SCP-079-CAPTCHA - Provide challenges for newly joined members
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CAPTCHA.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Rebuild the manifest by hand: python -m plugins.pics
+
+import logging
+import pickle
+from glob import glob
+from os import makedirs, replace, stat
+from os.path import dirname, exists
+from typing import Dict, Tuple
+
+from PIL import Image
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# The manifest of the picture library
+pic_manifest: str = "data/pics.manifest"
+# pic_manifest = {
+#     "assets/pics/cat/1.jpg": ("cat", 1024, 1512345678000000000, 300, 200)
+# }
+
+
+def get_pic_index(root: str = "assets/pics", manifest: str = pic_manifest,
+                  rebuild: bool = False) -> Dict[str, Dict[str, Tuple[int, int, int]]]:
+    # Get the pictures of each category with their width, height and byte size, only open the changed files
+    result = {}
+
+    try:
+        if not exists(root):
+            return {}
+
+        old = {}
+
+        if not rebuild and exists(manifest):
+            try:
+                with open(manifest, "rb") as f:
+                    old = pickle.load(f)
+            except Exception as e:
+                logger.warning(f"Load pic manifest error: {e}")
+
+        new = {}
+
+        for dir_path in sorted(glob(f"{root}/*")):
+            dir_name = dir_path.split("/")[-1]
+
+            if not 0 < len(dir_name.encode()) <= 64:
+                continue
+
+            for path in sorted(glob(f"{dir_path}/*")):
+                status = stat(path)
+                entry = old.get(path)
+
+                if not entry or entry[:3] != (dir_name, status.st_size, status.st_mtime_ns):
+                    try:
+                        with Image.open(path) as image:
+                            width, height = image.size
+                    except Exception as e:
+                        logger.warning(f"Read pic {path} error: {e}")
+                        continue
+
+                    entry = (dir_name, status.st_size, status.st_mtime_ns, width, height)
+
+                new[path] = entry
+                result.setdefault(dir_name, {})[path] = (entry[3], entry[4], entry[1])
+
+        if new == old:
+            return result
+
+        makedirs(dirname(manifest) or ".", exist_ok=True)
+
+        with open(f"{manifest}.tmp", "wb") as f:
+            pickle.dump(new, f)
+
+        replace(f"{manifest}.tmp", manifest)
+    except Exception as e:
+        logger.warning(f"Get pic index error: {e}", exc_info=True)
+
+    return result
+
+
+if __name__ == "__main__":
+    pic_index = get_pic_index(rebuild=True)
+    print(f"{len(pic_index)} categories, {sum(len(files) for files in pic_index.values())} pictures")
@@ -0,0 +1,155 @@
+# SCP-079-CAPTCHA - Provide challenges for newly joined members
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CAPTCHA.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from io import BytesIO
+from os import getpid
+from threading import local
+from typing import Dict, List, Tuple, Union
+
+from captcha.image import ImageCaptcha
+from claptcha import Claptcha
+from PIL.ImageFont import FreeTypeFont, truetype
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Generators of each thread, the generators are not thread-safe
+thread_data = local()
+# thread_data.generators = {
+#     ("captcha", "/usr/share/fonts/truetype/arphic-gkai00mp/gkai00mp.ttf"): ImageCaptcha()
+# }
+# thread_data.fonts = {
+#     ("/usr/share/fonts/truetype/arphic-gkai00mp/gkai00mp.ttf", 110): FreeTypeFont()
+# }
+
+
+class FontClaptcha(Claptcha):
+    # Claptcha that takes the loaded font of this thread instead of loading the font file itself
+    @property
+    def font(self) -> FreeTypeFont:
+        return self.loaded_font
+
+    @font.setter
+    def font(self, font: str):
+        self.loaded_font = get_font(font, self.h - 2 * self.margin_y)
+
+
+class ImageBuffer(BytesIO):
+    # A rendered image in memory, with its known size
+    def __init__(self, data: bytes = b"", width: int = 0, height: int = 0, name: str = "captcha.png"):
+        super().__init__(data)
+        self.width = width
+        self.height = height
+        self.name = name
+
+
+def get_font(font: str, size: int) -> FreeTypeFont:
+    # Get the loaded font of this thread at the size
+    fonts: Dict[Tuple[str, int], FreeTypeFont] = getattr(thread_data, "fonts", None)
+
+    if fonts is None:
+        fonts = thread_data.fonts = {}
+
+    result = fonts.get((font, size))
+
+    if result is None:
+        result = fonts[(font, size)] = truetype(font, size)
+
+    return result
+
+
+def get_generator(kind: str, font: str, noise: float) -> Union[Claptcha, ImageCaptcha, None]:
+    # Get the image generator of this thread, kind is captcha or claptcha
+    result = None
+
+    try:
+        generators: Dict[Tuple[str, str], Union[Claptcha, ImageCaptcha]] = getattr(thread_data, "generators", None)
+
+        if generators is None:
+            generators = thread_data.generators = {}
+
+        result = generators.get((kind, font))
+
+        if result is not None:
+            return result
+
+        result = new_generator(kind, font, noise)
+        generators[(kind, font)] = result
+    except Exception as e:
+        logger.warning(f"Get generator error: {e}", exc_info=True)
+
+    return result
+
+
+def new_generator(kind: str, font: str, noise: float) -> Union[Claptcha, ImageCaptcha, None]:
+    # Get a new image generator with the fonts loaded at each size it uses
+    result = None
+
+    try:
+        if kind == "claptcha":
+            result = FontClaptcha(source="", font=font, size=(300, 150), noise=noise)
+        else:
+            result = ImageCaptcha(width=300, height=150, fonts=[font])
+            _ = result.truefonts
+    except Exception as e:
+        logger.warning(f"New generator error: {e}", exc_info=True)
+
+    return result
+
+
+def render_image(kind: str, text: str, font: str, noise: float) -> Tuple[bytes, int, int]:
+    # Render the text as a PNG image, get the data and the size
+    result = (b"", 0, 0)
+
+    try:
+        generator = get_generator(kind, font, noise)
+
+        if isinstance(generator, Claptcha):
+            generator.source = text
+            _, image = generator.image
+        else:
+            image = generator.generate_image(text)
+
+        with BytesIO() as f:
+            image.save(f, format="PNG")
+            result = (f.getvalue(), *image.size)
+    except Exception as e:
+        logger.warning(f"Render image error: {e}", exc_info=True)
+
+    return result
+
+
+def render_ping() -> int:
+    # Check if the rendering process is ready
+    return getpid()
+
+
+def render_warmup(fonts: List[Tuple[str, str]], noise: float) -> bool:
+    # Create the generators of a rendering process, load the fonts once
+    result = False
+
+    try:
+        for kind, font in fonts:
+            get_generator(kind, font, noise)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Render warmup error: {e}", exc_info=True)
+
+    return result
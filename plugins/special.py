@@ -0,0 +1,67 @@
+# SCP-079-CAPTCHA - Provide challenges for newly joined members
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CAPTCHA.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from typing import Dict, Iterable
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+def get_special_dict(rules: Iterable[str]) -> Dict[str, str]:
+    # Get the special characters dictionary from the rules like "[abc]?#x"
+    result = {}
+
+    try:
+        for rule in rules:
+            # Check keys
+            if "[" not in rule:
+                continue
+
+            # Check value
+            if "?#" not in rule:
+                continue
+
+            keys = rule.split("]")[0][1:]
+            value = rule.split("?#")[1][1]
+
+            for k in keys:
+                result[k] = value
+    except Exception as e:
+        logger.warning(f"Get special dict error: {e}", exc_info=True)
+
+    return result
+
+
+def get_special_table(spc_dict: Dict[str, str], spe_dict: Dict[str, str]) -> Dict[int, str]:
+    # Get the translation table of special characters, spc first and then spe
+    result = {}
+
+    try:
+        for k in set(spc_dict) | set(spe_dict):
+            v = spc_dict.get(k, k)
+            v = spe_dict.get(v, v)
+
+            if v == k:
+                continue
+
+            result[ord(k)] = v
+    except Exception as e:
+        logger.warning(f"Get special table error: {e}", exc_info=True)
+
+    return result
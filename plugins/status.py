@@ -0,0 +1,703 @@
+# SCP-079-CAPTCHA - Provide challenges for newly joined members
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CAPTCHA.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import pickle
+import sqlite3
+from array import array
+from threading import Lock
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Union
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Plain values and their defaults
+status_values: Dict[str, Union[int, str]] = {
+    "name": "",
+    "mid": 0,
+    "time": 0,
+    "answer": "",
+    "limit": 0,
+    "try": 0
+}
+
+# Containers, created when they are used for the first time
+status_dicts: List[str] = ["join", "pass", "wait", "qns", "succeeded", "failed"]
+status_sets: List[str] = ["restricted", "banned", "manual"]
+
+# Projects that have a fixed score slot
+score_keys: List[str] = ["captcha", "clean", "lang", "long", "noflood", "noporn", "nospam", "warn"]
+score_index: Dict[str, int] = {k: i for i, k in enumerate(score_keys)}
+
+# The fixed keys of a user status
+status_keys: FrozenSet[str] = frozenset([*status_values, *status_dicts, *status_sets, "score"])
+
+# Waiting users of each group, maintained by WaitMap
+wait_index: Dict[int, Set[int]] = {}
+# wait_index = {
+#     -10012345678: {12345678}
+# }
+
+
+def keep_container(container: Any, key: str) -> bool:
+    # Let the record keep an empty container that was read and then changed,
+    # merge it if another one was kept in the meantime
+    owner = container.owner
+    container.owner = None
+    current = getattr(owner, key)
+
+    if current is None:
+        setattr(owner, key, container)
+        return True
+
+    if current is container:
+        return True
+
+    if isinstance(current, set):
+        current.update(container)
+    else:
+        for k, v in list(container.items()):
+            current[k] = v
+
+    return True
+
+
+class LazyDict(dict):
+    # An empty dict read from a record, the record only keeps it when it is changed
+    __slots__ = ("owner", "key")
+
+    def __init__(self, owner: Any = None, key: str = ""):
+        super().__init__()
+        self.owner = owner
+        self.key = key
+
+    def __setitem__(self, k: Any, v: Any):
+        super().__setitem__(k, v)
+        self.owner is not None and keep_container(self, self.key)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def setdefault(self, k: Any, v: Any = None) -> Any:
+        result = super().setdefault(k, v)
+        self.owner is not None and keep_container(self, self.key)
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.owner is not None and self and keep_container(self, self.key)
+
+
+class LazySet(set):
+    # An empty set read from a record, the record only keeps it when it is changed
+    __slots__ = ("owner", "key")
+
+    def __init__(self, owner: Any = None, key: str = ""):
+        super().__init__()
+        self.owner = owner
+        self.key = key
+
+    def __ior__(self, other: Any) -> "LazySet":
+        self.update(other)
+        return self
+
+    def __reduce__(self):
+        return set, (set(self),)
+
+    def add(self, item: Any):
+        super().add(item)
+        self.owner is not None and keep_container(self, self.key)
+
+    def update(self, *others):
+        super().update(*others)
+        self.owner is not None and self and keep_container(self, self.key)
+
+
+class Score:
+    # The scores of a user, a fixed array for the known projects
+    __slots__ = ("scores", "extra", "owner")
+
+    def __init__(self, data: dict = None, owner: Any = None):
+        self.scores = array("d", bytes(8 * len(score_keys)))
+        self.extra: Optional[Dict[str, float]] = None
+        self.owner = owner
+
+        for key, value in (data or {}).items():
+            self[key] = value
+
+    def __getitem__(self, key: str) -> float:
+        if key in score_index:
+            return self.scores[score_index[key]]
+
+        if self.extra is None:
+            raise KeyError(key)
+
+        return self.extra[key]
+
+    def __setitem__(self, key: str, value: float):
+        if key in score_index:
+            self.scores[score_index[key]] = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+
+            self.extra[key] = value
+
+        self.owner is not None and keep_container(self, "score")
+
+    def __contains__(self, key: str) -> bool:
+        return key in score_index or bool(self.extra and key in self.extra)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __getstate__(self) -> dict:
+        return {key: value for key, value in self.items() if value}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state)
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def is_empty(self) -> bool:
+        return not self.extra and not any(self.scores)
+
+    def items(self) -> list:
+        return list(zip(self.keys(), self.values()))
+
+    def keys(self) -> List[str]:
+        return score_keys + list(self.extra or {})
+
+    def to_dict(self) -> Dict[str, float]:
+        return dict(self.items())
+
+    def values(self) -> List[float]:
+        return list(self.scores) + list((self.extra or {}).values())
+
+
+class WaitMap(dict):
+    # The waiting groups of a user, keeps the wait index up to date if the record is in user_ids
+    __slots__ = ("uid", "indexed", "owner")
+
+    def __init__(self, uid: int = 0, data: dict = None, indexed: bool = False, owner: Any = None):
+        super().__init__()
+        self.uid = uid
+        self.indexed = indexed
+        self.owner = owner
+
+        for gid, time in (data or {}).items():
+            self[gid] = time
+
+    def __setitem__(self, gid: int, time: int):
+        super().__setitem__(gid, time)
+        self.index(gid)
+        self.owner is not None and keep_container(self, "wait")
+
+    def __delitem__(self, gid: int):
+        super().__delitem__(gid)
+        self.index(gid)
+
+    def __reduce__(self):
+        # Copies and pickles are plain dicts, they should not touch the index
+        return dict, (dict(self),)
+
+    def clear(self):
+        gids = list(self)
+        super().clear()
+
+        for gid in gids:
+            self.index(gid)
+
+    def index(self, gid: int):
+        # Update the index of a group, the copies and the records not in user_ids are not indexed
+        if not self.indexed:
+            return
+
+        if self.get(gid):
+            wait_index.setdefault(gid, set()).add(self.uid)
+            return
+
+        uids = wait_index.get(gid)
+
+        if uids is None:
+            return
+
+        uids.discard(self.uid)
+        not uids and wait_index.pop(gid, None)
+
+    def pop(self, gid: int, *args) -> Any:
+        result = super().pop(gid, *args)
+        self.index(gid)
+        return result
+
+    def popitem(self) -> tuple:
+        gid, time = super().popitem()
+        self.index(gid)
+        return gid, time
+
+    def setdefault(self, gid: int, time: int = None) -> Any:
+        result = super().setdefault(gid, time)
+        self.index(gid)
+        self.owner is not None and keep_container(self, "wait")
+        return result
+
+    def update(self, *args, **kwargs):
+        for gid, time in dict(*args, **kwargs).items():
+            self[gid] = time
+
+
+class UserStatus:
+    # The status of a user, containers are only kept when they are used,
+    # only the records in user_ids are indexed
+    __slots__ = ("uid", "indexed", *status_values, *status_dicts, *status_sets, "score", "extra")
+
+    def __init__(self, uid: int = 0, data: dict = None, indexed: bool = False):
+        self.uid = uid
+        self.indexed = indexed
+
+        for key, value in status_values.items():
+            setattr(self, key, value)
+
+        for key in status_dicts + status_sets + ["score", "extra"]:
+            setattr(self, key, None)
+
+        for key, value in (data or {}).items():
+            self[key] = value
+
+    def __getitem__(self, key: str) -> Any:
+        if key in status_values:
+            return getattr(self, key)
+
+        if key in status_dicts or key in status_sets or key == "score":
+            value = getattr(self, key)
+            return self.new(key) if value is None else value
+
+        if self.extra is None:
+            raise KeyError(key)
+
+        return self.extra[key]
+
+    def __setitem__(self, key: str, value: Any):
+        if key == "wait":
+            self.wait is not None and self.wait is not value and self.wait.clear()
+            self.wait = (value if isinstance(value, WaitMap) and value.uid == self.uid and value.indexed == self.indexed
+                         else WaitMap(self.uid, value, self.indexed))
+        elif key in status_values or key in status_dicts or key in status_sets:
+            setattr(self, key, value)
+        elif key == "score":
+            self.score = value if isinstance(value, Score) else Score(value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+
+            self.extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in status_keys or (self.extra is not None and key in self.extra)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __getstate__(self) -> dict:
+        result = {"uid": self.uid}
+
+        for key in self.keys():
+            value = self.peek(key)
+
+            if key in status_values and value == status_values[key]:
+                continue
+
+            if key == "score" and value.is_empty():
+                continue
+
+            if key not in status_values and key != "score" and not value:
+                continue
+
+            if key == "wait":
+                value = dict(value)
+
+            result[key] = value
+
+        return result
+
+    def __setstate__(self, state: dict):
+        state = dict(state)
+        self.__init__(state.pop("uid", 0), state)
+
+    def __repr__(self) -> str:
+        return f"UserStatus({self.uid}, {self.to_dict()!r})"
+
+    def compact(self) -> bool:
+        # Drop the empty containers
+        for key in status_dicts + status_sets:
+            value = getattr(self, key)
+
+            if value is not None and not value:
+                setattr(self, key, None)
+
+        if self.score is not None and self.score.is_empty():
+            self.score = None
+
+        if self.extra is not None and not self.extra:
+            self.extra = None
+
+        return True
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in status_keys:
+            return self[key]
+
+        return default if self.extra is None else self.extra.get(key, default)
+
+    def items(self) -> list:
+        return [(key, self.peek(key)) for key in self.keys()]
+
+    def keys(self) -> List[str]:
+        return list(status_values) + status_dicts + status_sets + ["score"] + list(self.extra or {})
+
+    def new(self, key: str) -> Union[dict, set, Score]:
+        # Get a new empty container, the record keeps it when it is changed
+        if key == "score":
+            return Score(owner=self)
+
+        if key in status_sets:
+            return LazySet(self, key)
+
+        if key == "wait":
+            return WaitMap(self.uid, indexed=self.indexed, owner=self)
+
+        return LazyDict(self, key)
+
+    def peek(self, key: str) -> Any:
+        # Get a value without keeping a new empty container
+        return self[key]
+
+    def set_indexed(self, indexed: bool) -> bool:
+        # Add the record to the wait index when it is put in user_ids, or stop indexing it
+        self.indexed = indexed
+
+        if self.wait is None:
+            return True
+
+        self.wait.indexed = indexed
+
+        for gid in list(self.wait):
+            indexed and self.wait.index(gid)
+
+        return True
+
+    def to_dict(self) -> dict:
+        result = {}
+
+        for key, value in self.items():
+            if key == "score":
+                value = value.to_dict()
+            elif isinstance(value, dict):
+                value = dict(value)
+            elif isinstance(value, set):
+                value = set(value)
+
+            result[key] = value
+
+        return result
+
+    def values(self) -> list:
+        return [self.peek(key) for key in self.keys()]
+
+
+class UserTable(dict):
+    # The user records of the sqlite storage, only the live and the recently used records stay in memory,
+    # the others are read from the table when they are used, the lock is the one that guards the connection
+    def __init__(self, connection: sqlite3.Connection, lock: Lock, data: dict = None):
+        super().__init__(data or {})
+        self.connection = connection
+        self.lock = lock
+        self.used: Set[int] = set()
+        self.missing: Set[int] = set()
+
+    def __missing__(self, uid: int) -> "UserStatus":
+        record = self.load(uid)
+
+        if record is None:
+            raise KeyError(uid)
+
+        return record
+
+    def __getitem__(self, uid: int) -> "UserStatus":
+        self.used.add(uid)
+        return super().__getitem__(uid)
+
+    def __setitem__(self, uid: int, record: "UserStatus"):
+        self.missing.discard(uid)
+        super().__setitem__(uid, record)
+
+    def __contains__(self, uid: int) -> bool:
+        return super().__contains__(uid) or self.load(uid) is not None
+
+    def __bool__(self) -> bool:
+        return super().__len__() > 0 or bool(self.uids())
+
+    def __reduce__(self):
+        # Copies and pickles are plain dicts of all records
+        return dict, (self.to_dict(),)
+
+    def clear(self):
+        with self.lock:
+            with self.connection:
+                self.connection.execute("DELETE FROM user_ids")
+
+            super().clear()
+            self.used.clear()
+            self.missing.clear()
+
+    def evict(self, keep: Set[int]) -> int:
+        # Drop the saved records that are not live and not used since the last time, get the count
+        count = 0
+
+        with self.lock:
+            for uid in list(super().keys()):
+                record = super().get(uid)
+
+                if uid in self.used or uid in keep or record is None or is_live_user(record):
+                    continue
+
+                super().pop(uid, None)
+                count += 1
+
+            self.used = set()
+            self.missing = set()
+
+        return count
+
+    def get(self, uid: int, default: Any = None) -> Any:
+        try:
+            return self[uid]
+        except KeyError:
+            return default
+
+    def load(self, uid: int) -> Optional["UserStatus"]:
+        # Read a record from the table
+        if not isinstance(uid, int) or uid in self.missing:
+            return None
+
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM user_ids WHERE id = ?", (uid,)).fetchone()
+
+        record = row and get_user_status(uid, pickle.loads(row[0]))
+
+        if not record:
+            self.missing.add(uid)
+            return None
+
+        record.set_indexed(True)
+
+        return self.setdefault(uid, record)
+
+    def to_dict(self) -> Dict[int, "UserStatus"]:
+        # Get all records without keeping them in memory
+        with self.lock:
+            rows = self.connection.execute("SELECT id, data FROM user_ids").fetchall()
+
+        result = get_user_records({uid: pickle.loads(data) for uid, data in rows})
+        result.update(super().items())
+
+        return result
+
+    def uids(self) -> List[int]:
+        # Get the ids of all records
+        with self.lock:
+            rows = self.connection.execute("SELECT id FROM user_ids").fetchall()
+
+        return list(set(super().keys()) | {row[0] for row in rows})
+
+
+def get_all_uids(user_ids: Dict[int, UserStatus]) -> List[int]:
+    # Get the ids of all users, including the ones that are not in memory
+    result = []
+
+    try:
+        result = user_ids.uids() if isinstance(user_ids, UserTable) else list(user_ids)
+    except Exception as e:
+        logger.warning(f"Get all uids error: {e}", exc_info=True)
+
+    return result
+
+
+def get_user_records(data: dict) -> Dict[int, UserStatus]:
+    # Get the user status records, skip the ones that can not be converted
+    result = {}
+
+    try:
+        for uid in list(data):
+            record = get_user_status(uid, data[uid])
+
+            if record is None:
+                logger.warning(f"Skip the bad record of user {uid}")
+                continue
+
+            result[uid] = record
+    except Exception as e:
+        logger.warning(f"Get user records error: {e}", exc_info=True)
+
+    return result
+
+
+def get_user_status(uid: int, data: Union[dict, UserStatus] = None) -> UserStatus:
+    # Get a user status record, convert the old dict format
+    result = None
+
+    try:
+        if isinstance(data, UserStatus):
+            result = data
+            result.uid = uid
+        else:
+            result = UserStatus(uid, data)
+
+        result.compact()
+    except Exception as e:
+        logger.warning(f"Get user status error: {e}", exc_info=True)
+
+    return result
+
+
+def check_wait_index(user_ids: Dict[int, UserStatus]) -> bool:
+    # Compare the wait index with a full scan, rebuild it if they differ
+    result = False
+
+    try:
+        scan = {}
+
+        for uid, record in list(user_ids.items()):
+            for gid, time in list(record.peek("wait").items()):
+                time and scan.setdefault(gid, set()).add(uid)
+
+        index = {gid: set(uids) for gid, uids in list(wait_index.items())}
+
+        if scan == index:
+            return True
+
+        for gid in set(scan) | set(index):
+            if scan.get(gid, set()) == index.get(gid, set()):
+                continue
+
+            logger.warning(f"Wait index of {gid} mismatch: "
+                           f"missing {scan.get(gid, set()) - index.get(gid, set())}, "
+                           f"extra {index.get(gid, set()) - scan.get(gid, set())}")
+
+        rebuild_wait_index(user_ids)
+    except Exception as e:
+        logger.warning(f"Check wait index error: {e}", exc_info=True)
+
+    return result
+
+
+def get_wait_count(gid: int) -> int:
+    # Get the count of waiting users in the group
+    result = 0
+
+    try:
+        result = len(wait_index.get(gid, set()))
+    except Exception as e:
+        logger.warning(f"Get wait count error: {e}", exc_info=True)
+
+    return result
+
+
+def get_wait_groups() -> Set[int]:
+    # Get the groups that have waiting users
+    result = set()
+
+    try:
+        result = set(wait_index)
+    except Exception as e:
+        logger.warning(f"Get wait groups error: {e}", exc_info=True)
+
+    return result
+
+
+def get_wait_users(gid: int) -> List[int]:
+    # Get the waiting users in the group
+    result = []
+
+    try:
+        result = list(wait_index.get(gid, set()))
+    except Exception as e:
+        logger.warning(f"Get wait users error: {e}", exc_info=True)
+
+    return result
+
+
+def is_live_user(user_status: UserStatus) -> bool:
+    # Check whether the user is waiting, punished or in the CAPTCHA group
+    result = False
+
+    try:
+        result = bool(user_status.time
+                      or any(user_status.peek("wait").values())
+                      or any(user_status.peek("failed").values()))
+    except Exception as e:
+        logger.warning(f"Is live user error: {e}", exc_info=True)
+
+    return result
+
+
+def drop_wait_index(user_ids: Dict[int, UserStatus]) -> bool:
+    # Stop indexing the user records that are replaced, clear the wait index
+    result = False
+
+    try:
+        for record in list(user_ids.values()):
+            record.set_indexed(False)
+
+        wait_index.clear()
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Drop wait index error: {e}", exc_info=True)
+
+    return result
+
+
+def rebuild_wait_index(user_ids: Dict[int, UserStatus]) -> bool:
+    # Rebuild the wait index from all user records in memory, they are indexed from now on
+    result = False
+
+    try:
+        wait_index.clear()
+
+        for record in list(user_ids.values()):
+            record.set_indexed(True)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Rebuild wait index error: {e}", exc_info=True)
+
+    return result
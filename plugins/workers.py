@@ -0,0 +1,244 @@
+# SCP-079-CAPTCHA - Provide challenges for newly joined members
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CAPTCHA.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from collections import deque
+from itertools import count
+from queue import Empty, Full, PriorityQueue
+from threading import BoundedSemaphore, Lock, Thread, current_thread
+from typing import Callable, Deque, Dict, Set, Tuple
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Priorities of the jobs and the Bot API calls, a lower number goes first
+priority_high = 0
+priority_normal = 1
+priority_low = 2
+
+# Seconds to wait for the workers of each pool to finish the queued jobs at exit
+stop_timeout = 30.0
+
+# Tell a worker to quit
+stop = object()
+
+
+class WorkerPool:
+    # A bounded number of threads working on a bounded queue, the jobs are taken by priority and then in order,
+    # a full queue runs the jobs on a bounded number of overflow threads
+    def __init__(self, name: str, size: int, queue: int, overflow: int, daemon: bool = True, idle: float = 60.0):
+        self.name = name
+        self.size = size
+        self.daemon = daemon
+        self.idle = idle
+        self.queue = PriorityQueue(maxsize=queue)
+        self.seq = count()
+        self.overflow = BoundedSemaphore(overflow)
+        self.deferred: Deque[Tuple[int, int, tuple]] = deque(maxlen=queue)
+        self.lock = Lock()
+        self.workers: Set[Thread] = set()
+        self.waiting = 0
+        self.peak = 0
+        self.counts: Dict[str, int] = {
+            "submitted": 0,
+            "done": 0,
+            "error": 0,
+            "overflow": 0,
+            "forced": 0,
+            "deferred": 0,
+            "dropped": 0
+        }
+
+    def defer(self, entry: Tuple[int, int, tuple]) -> bool:
+        # Keep a job until the queue has room, drop it if too many jobs are kept, the caller holds the lock
+        if len(self.deferred) >= (self.deferred.maxlen or 0):
+            self.counts["dropped"] += 1
+            return False
+
+        self.deferred.append(entry)
+        self.counts["deferred"] += 1
+
+        return True
+
+    def refill(self) -> bool:
+        # Move the deferred jobs into the queue while it has room
+        with self.lock:
+            while self.deferred:
+                try:
+                    self.queue.put_nowait(self.deferred[0])
+                except Full:
+                    return False
+
+                self.deferred.popleft()
+
+        return True
+
+    def spawn(self) -> bool:
+        # Start a worker if the queued jobs outnumber the idle workers, the caller holds the lock
+        if len(self.workers) >= self.size or self.queue.qsize() <= self.waiting:
+            return False
+
+        t = Thread(target=self.work, name=f"{self.name}-{len(self.workers)}", daemon=self.daemon)
+        self.workers.add(t)
+        t.start()
+
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        # Get the queue depth and the counts
+        with self.lock:
+            return {
+                "workers": len(self.workers),
+                "depth": self.queue.qsize(),
+                "waiting": len(self.deferred),
+                "peak": self.peak,
+                **self.counts
+            }
+
+    def stop(self, timeout: float = None) -> bool:
+        # Let the workers finish the queued jobs and quit
+        with self.lock:
+            workers = list(self.workers)
+
+        for _ in workers:
+            self.queue.put((priority_low + 1, next(self.seq), stop))
+
+        for t in workers:
+            t.join(timeout)
+
+        return True
+
+    def submit(self, target: Callable, args: tuple = (), kwargs: dict = None, priority: int = priority_normal) -> bool:
+        # Queue a job without waiting, so the handler threads are never blocked by a busy pool,
+        # if the queue is full run it on an overflow thread, past the overflow limit only the high priority jobs
+        # and the jobs of the disk pool still get a thread, the normal jobs wait for room, the low jobs are dropped
+        item = (target, args, kwargs or {})
+        entry = (priority, next(self.seq), item)
+
+        try:
+            self.queue.put_nowait(entry)
+        except Full:
+            if self.overflow.acquire(False):
+                with self.lock:
+                    self.counts["overflow"] += 1
+
+                Thread(target=self.call, args=(*item, True), daemon=self.daemon).start()
+                return True
+
+            with self.lock:
+                if priority <= priority_high or not self.daemon:
+                    self.counts["forced"] += 1
+                elif priority == priority_normal:
+                    return self.defer(entry)
+                else:
+                    self.counts["dropped"] += 1
+                    return False
+
+            Thread(target=self.call, args=item, daemon=self.daemon).start()
+            return True
+
+        with self.lock:
+            self.counts["submitted"] += 1
+            self.peak = max(self.peak, self.queue.qsize())
+            self.spawn()
+
+        return True
+
+    def call(self, target: Callable, args: tuple, kwargs: dict, overflow: bool = False) -> bool:
+        # Run a job, an overflow job gives back its slot when it is done
+        result = False
+
+        try:
+            target(*args, **kwargs)
+            result = True
+        except Exception as e:
+            logger.warning(f"Worker {self.name} job {getattr(target, '__name__', target)} error: {e}", exc_info=True)
+        finally:
+            overflow and self.overflow.release()
+
+        with self.lock:
+            self.counts["done" if result else "error"] += 1
+
+        return result
+
+    def work(self) -> bool:
+        # Take the jobs until the pool is idle for a while
+        while True:
+            self.deferred and self.refill()
+
+            with self.lock:
+                self.waiting += 1
+
+            try:
+                _, _, item = self.queue.get(timeout=self.idle)
+            except Empty:
+                item = None
+
+            with self.lock:
+                self.waiting -= 1
+
+                if item is stop or (item is None and self.queue.empty() and not self.deferred):
+                    self.workers.discard(current_thread())
+                    return True
+
+            if item is None:
+                continue
+
+            self.call(*item)
+
+
+def get_pools(sizes: Dict[str, int], queue: int, overflow: int) -> Dict[str, WorkerPool]:
+    # Get the worker pools, the disk pool is not daemonic so the writes are finished before exit,
+    # its idle workers quit soon to let the process exit
+    result = {}
+
+    try:
+        for name, size in sizes.items():
+            daemon = name != "disk"
+            result[name] = WorkerPool(name, size, queue, overflow, daemon, 60.0 if daemon else 1.0)
+    except Exception as e:
+        logger.warning(f"Get pools error: {e}", exc_info=True)
+
+    return result
+
+
+def get_pool_stats(pools: Dict[str, WorkerPool]) -> Dict[str, Dict[str, int]]:
+    # Get the stats of all pools
+    result = {}
+
+    try:
+        result = {name: pool.stats() for name, pool in pools.items()}
+    except Exception as e:
+        logger.warning(f"Get pool stats error: {e}", exc_info=True)
+
+    return result
+
+
+def stop_pools(pools: Dict[str, WorkerPool], timeout: float = stop_timeout) -> bool:
+    # Let the workers of all pools finish the queued jobs and quit
+    result = False
+
+    try:
+        for pool in pools.values():
+            pool.stop(timeout)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Stop pools error: {e}", exc_info=True)
+
+    return result
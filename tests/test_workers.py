@@ -0,0 +1,65 @@
+# SCP-079-CAPTCHA - Provide challenges for newly joined members
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CAPTCHA.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Event
+from time import sleep
+
+from plugins.workers import WorkerPool, get_pools, priority_high, priority_low, priority_normal, stop_pools
+
+
+def test_stop_pools_finishes_queued_jobs():
+    # The shutdown path drains the queues of all pools, including the disk pool
+    pools = get_pools({"disk": 1, "write": 2}, 100, 4)
+    done = []
+
+    for name, pool in pools.items():
+        for i in range(5):
+            pool.submit(lambda n=name, i=i: sleep(0.01) or done.append((n, i)))
+
+    assert stop_pools(pools, 5.0)
+    assert len(done) == 10
+    assert all(not pool.workers for pool in pools.values())
+
+
+def test_stop_pools_without_workers():
+    # Stopping idle pools returns at once
+    assert stop_pools({"write": WorkerPool("write", 1, 10, 4)}, 1.0)
+
+
+def test_submit_caps_the_overflow_threads():
+    # Past the overflow limit, the normal jobs wait for room, the low jobs are dropped, the high jobs still run
+    pool = WorkerPool("write", 1, 1, 1)
+    gate = Event()
+    done = []
+
+    for priority in (priority_normal, priority_normal, priority_normal, priority_normal, priority_low, priority_high):
+        pool.submit(lambda p=priority: gate.wait(5) and done.append(p), priority=priority)
+
+        # Let the worker take the first job
+        sleep(0.05)
+
+    stats = pool.stats()
+    assert stats["overflow"] == 1
+    assert stats["deferred"] == 1
+    assert stats["dropped"] == 1
+    assert stats["forced"] == 1
+
+    gate.set()
+    sleep(0.2)
+    assert stop_pools({"write": pool}, 5.0)
+    assert sorted(done) == [priority_high] + [priority_normal] * 4